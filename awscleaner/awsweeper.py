@@ -13,15 +13,40 @@
 #
 # Copyright: Red Hat Inc. 2025
 # Author: Lukas Doktor <ldoktor@redhat.com>
+import hashlib
+import json
 import os
 import subprocess
 import sys
+import tempfile
+import time
 
 import yaml
 
 
+class AwsweeperError(Exception):
+    """
+    Raised when awsweeper fails or its output can not be parsed.
+
+    :ivar returncode: Exit status of awsweeper (0 when only its output
+                      could not be parsed)
+    :vartype returncode: int
+    """
+
+    def __init__(self, message, returncode=None):
+        super().__init__(message)
+        self.returncode = returncode
+
+
 class AwsweeperRunner:
-    """Handles running awsweeper or loading its output from a file."""
+    """
+    Handles running awsweeper or loading its output from a file.
+
+    :ivar CHECKPOINT_SUFFIX: Suffix of the checkpoint files
+    :vartype CHECKPOINT_SUFFIX: str
+    """
+
+    CHECKPOINT_SUFFIX = ".checkpoint.yaml"
 
     @staticmethod
     def run(args):
@@ -33,6 +58,23 @@ class AwsweeperRunner:
         :return: Parsed YAML output from awsweeper or empty list if no output
         :rtype: list
         """
+        try:
+            return AwsweeperRunner._run(args)
+        except AwsweeperError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+
+    @staticmethod
+    def _run(args):
+        """
+        Run awsweeper once and return parsed YAML output.
+
+        :param args: Extra awsweeper arguments
+        :type args: list
+        :return: Parsed YAML output from awsweeper or empty list if no output
+        :rtype: list
+        :raises AwsweeperError: When awsweeper fails or the output is invalid
+        """
         if not args:
             args = []
         result = subprocess.run(
@@ -42,8 +84,9 @@ class AwsweeperRunner:
             check=False,
         )
         if result.returncode != 0:
-            print("Error running awsweeper:", result.stderr, file=sys.stderr)
-            sys.exit(1)
+            raise AwsweeperError(
+                f"Error running awsweeper: {result.stderr}", result.returncode
+            )
         elif os.environ.get("DEBUG", "no").lower() == "yes":
             print(
                 f"awsweeper stdout:\n{result.stdout}\nawsweeper stderr:\n"
@@ -54,5 +97,233 @@ class AwsweeperRunner:
         try:
             return yaml.safe_load(result.stdout) or []
         except yaml.YAMLError as e:
-            print(f"Error parsing awsweeper output: {e}", file=sys.stderr)
-            sys.exit(1)
+            raise AwsweeperError(
+                f"Error parsing awsweeper output: {e}", result.returncode
+            )
+
+    @staticmethod
+    def run_checkpointed(
+        args,
+        checkpoint_dir=None,
+        regions=None,
+        config=None,
+        retries=0,
+        backoff=5.0,
+        types=None,
+        checkpoint_max_age=3600,
+    ):
+        """
+        Run awsweeper split into units (region and/or resource type).
+
+        Each unit is executed separately and retried on failure. When
+        ``checkpoint_dir`` is set, each resource type of the ``config`` is a
+        separate unit, the parsed output of each finished unit is persisted
+        there and a rerun only executes the missing units. Without it all
+        the (selected) types are scanned by a single awsweeper process per
+        region as splitting them would only slow the scan down. The
+        checkpoints are keyed by a hash of the arguments, region and type
+        filters so changed settings never reuse mismatching output.
+        Checkpoints older than ``checkpoint_max_age`` as well as the ones
+        not covered by this run are removed before the scan; all
+        checkpoints are removed once all units succeed.
+
+        :param args: Extra awsweeper arguments (without the config file when
+                     ``config`` is used)
+        :type args: list
+        :param checkpoint_dir: Directory to persist finished units to
+        :type checkpoint_dir: str, optional
+        :param regions: Regions to scan separately (``--region``)
+        :type regions: list, optional
+        :param config: Path to awsweeper config file
+        :type config: str, optional
+        :param retries: How many times to retry a failed unit
+        :type retries: int
+        :param backoff: Delay before the first retry, doubled on each retry
+        :type backoff: float
+        :param types: Only scan these resource types of the ``config``
+        :type types: set, optional
+        :param checkpoint_max_age: Maximum age of reusable checkpoints
+        :type checkpoint_max_age: float
+        :return: Concatenated parsed output of all units (without duplicate
+                 (type, id) of global resources reported by each region)
+        :rtype: list
+        :raises AwsweeperError: When any unit failed (carrying the exit
+                                status of the last failed unit)
+        """
+        if not args:
+            args = []
+        if checkpoint_dir:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+        if config:
+            config_data = AwsweeperRunner.load_config(config)
+            config_data = {
+                rtype: filters
+                for rtype, filters in config_data.items()
+                if types is None or rtype in types
+            }
+            if not config_data:
+                return []
+            if checkpoint_dir:
+                unit_configs = [
+                    (rtype, {rtype: filters})
+                    for rtype, filters in config_data.items()
+                ]
+            else:
+                unit_configs = [(None, config_data)]
+        else:
+            unit_configs = [(None, None)]
+
+        units = []
+        for region in regions or [None]:
+            for rtype, unit_config in unit_configs:
+                unit = f"{region or 'default'}-{rtype or 'all'}"
+                path = None
+                if checkpoint_dir:
+                    digest = hashlib.sha256(
+                        json.dumps(
+                            [args, region, rtype, unit_config],
+                            sort_keys=True,
+                            default=str,
+                        ).encode()
+                    ).hexdigest()[:16]
+                    path = os.path.join(
+                        checkpoint_dir,
+                        f"{unit}-{digest}{AwsweeperRunner.CHECKPOINT_SUFFIX}",
+                    )
+                units.append((region, unit_config, unit, path))
+        checkpoints = [path for _, _, _, path in units if path]
+        if checkpoint_dir:
+            AwsweeperRunner._clean_checkpoints(
+                checkpoint_dir, checkpoints, checkpoint_max_age
+            )
+
+        results = []
+        keys = set()
+
+        def merge(output):
+            """Global resources (eg. IAM) are reported by every region"""
+            for r in output:
+                key = (r.get("type"), r.get("id"))
+                if key not in keys:
+                    keys.add(key)
+                    results.append(r)
+
+        failed = []
+        returncode = None
+        for region, unit_config, unit, path in units:
+            if path and os.path.exists(path):
+                print(f"Reusing checkpoint {path}", file=sys.stderr)
+                with open(path, "r") as f:
+                    merge(yaml.safe_load(f) or [])
+                continue
+            unit_args = list(args)
+            if region:
+                unit_args = ["--region", region] + unit_args
+            try:
+                if unit_config is not None:
+                    output = AwsweeperRunner._run_config(
+                        unit_args, unit_config, retries, backoff
+                    )
+                else:
+                    output = AwsweeperRunner._run_unit(
+                        unit_args, retries, backoff
+                    )
+            except AwsweeperError as e:
+                print(f"Unit {unit} failed: {e}", file=sys.stderr)
+                failed.append(unit)
+                returncode = e.returncode
+                continue
+            if path:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w") as f:
+                    yaml.safe_dump(output, f, default_flow_style=False)
+                os.replace(tmp_path, path)
+            merge(output)
+
+        if failed:
+            raise AwsweeperError(
+                f"Failed awsweeper units: {', '.join(failed)}; rerun to "
+                "resume the scan",
+                returncode,
+            )
+        for path in checkpoints:
+            os.remove(path)
+        return results
+
+    @staticmethod
+    def _clean_checkpoints(checkpoint_dir, checkpoints, max_age):
+        """
+        Remove checkpoints that are too old or not used by this run.
+
+        :param checkpoint_dir: Directory with the checkpoints
+        :param checkpoints: Checkpoint paths of this run
+        :param max_age: Maximum age of reusable checkpoints
+        """
+        now = time.time()
+        for name in os.listdir(checkpoint_dir):
+            path = os.path.join(checkpoint_dir, name)
+            if name.endswith(f"{AwsweeperRunner.CHECKPOINT_SUFFIX}.tmp"):
+                os.remove(path)
+            elif name.endswith(AwsweeperRunner.CHECKPOINT_SUFFIX) and (
+                path not in checkpoints
+                or now - os.path.getmtime(path) > max_age
+            ):
+                print(f"Removing stale checkpoint {path}", file=sys.stderr)
+                os.remove(path)
+
+    @staticmethod
+    def load_config(config):
+        """
+        Load awsweeper config file.
+
+        :param config: Path to awsweeper config file
+        :type config: str
+        :return: Mapping of resource types to their filters
+        :rtype: dict
+        """
+        with open(config, "r") as f:
+            return yaml.safe_load(f) or {}
+
+    @staticmethod
+    def _run_config(args, config_data, retries, backoff):
+        """
+        Run awsweeper unit with a (filtered) config.
+
+        :param args: Extra awsweeper arguments
+        :param config_data: Mapping of awsweeper resource types to filters
+        :type config_data: dict
+        :return: Parsed YAML output from awsweeper
+        :rtype: list
+        """
+        with tempfile.NamedTemporaryFile(
+            mode="w", suffix=".yaml", delete=False
+        ) as config:
+            yaml.safe_dump(config_data, config)
+        try:
+            return AwsweeperRunner._run_unit(
+                args + [config.name], retries, backoff
+            )
+        finally:
+            os.remove(config.name)
+
+    @staticmethod
+    def _run_unit(args, retries, backoff):
+        """
+        Run awsweeper with retries and exponential backoff.
+
+        :param args: Extra awsweeper arguments
+        :param retries: How many times to retry on failure
+        :param backoff: Delay before the first retry, doubled on each retry
+        :return: Parsed YAML output from awsweeper
+        :rtype: list
+        :raises AwsweeperError: When all attempts fail
+        """
+        for attempt in range(retries + 1):
+            try:
+                return AwsweeperRunner._run(args)
+            except AwsweeperError as e:
+                if attempt >= retries:
+                    raise
+                delay = backoff * 2**attempt
+                print(f"{e}; retrying in {delay}s", file=sys.stderr)
+                time.sleep(delay)
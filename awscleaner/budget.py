@@ -0,0 +1,151 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright: Red Hat Inc. 2025
+# Author: Lukas Doktor <ldoktor@redhat.com>
+import heapq
+from collections import defaultdict
+
+
+class _BoundedHeap:
+    """
+    Heap of at most ``limit`` oldest entries; the root is the youngest one.
+
+    Entries are ``[-seen, -seq, resource, alive]`` lists shared between
+    heaps; removed entries are only marked dead and dropped lazily (the
+    heap is compacted once dead entries outnumber the live ones).
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.entries = []
+        self.size = 0
+
+    def push(self, entry):
+        """
+        Push the entry keeping the limit.
+
+        :returns: The entry pushed out (possibly the given one) or None
+        """
+        while self.entries and not self.entries[0][3]:
+            heapq.heappop(self.entries)
+        if self.size < self.limit:
+            heapq.heappush(self.entries, entry)
+            self.size += 1
+            return None
+        if not self.entries or entry < self.entries[0]:
+            return entry
+        return heapq.heapreplace(self.entries, entry)
+
+    def remove(self, entry):
+        """Remove the (live) entry"""
+        entry[3] = False
+        self.size -= 1
+        if len(self.entries) > 2 * self.size:
+            self.entries = [entry for entry in self.entries if entry[3]]
+            heapq.heapify(self.entries)
+
+    def live(self):
+        """Return the live entries"""
+        return [entry for entry in self.entries if entry[3]]
+
+
+class DeletionBudget:
+    """
+    Selects the oldest expired resources within the deletion limits.
+
+    Resources are offered one by one and only the oldest ones are kept in
+    bounded heaps: one global heap of at most ``max_deletions`` entries and
+    one heap per type with a per-type limit. Resources that do not fit (or
+    are pushed out later) are counted as deferred.
+
+    With a global limit an entry pushed out of the global heap can never
+    be selected, therefore it is dropped from its type heap as well and
+    the per-type heaps only hold entries of the global one. The memory is
+    therefore O(``max_deletions``) regardless of the number of expired
+    resources and types (O(sum of per-type limits) without a global limit).
+    """
+
+    def __init__(self, max_deletions=None, max_per_type=None):
+        """
+        :param max_deletions: Global limit of deletions (None = unlimited)
+        :type max_deletions: int, optional
+        :param max_per_type: Limit of deletions per resource type
+        :type max_per_type: dict, optional
+        """
+        self.max_deletions = max_deletions
+        self.max_per_type = max_per_type or {}
+        self.deferred = defaultdict(int)
+        self._global = None
+        if max_deletions is not None:
+            self._global = _BoundedHeap(max_deletions)
+        # type -> heap of types with a per-type limit
+        self._heaps = {}
+        # (seq, resource) pairs of types without any limit
+        self._unlimited = []
+        self._seq = 0
+
+    def offer(self, seen, resource):
+        """
+        Offer an expired resource for deletion.
+
+        :param seen: Timestamp the age is computed from (older is preferred)
+        :type seen: float
+        :param resource: The expired resource
+        :type resource: dict
+        """
+        self._seq += 1
+        rtype = resource["type"]
+        limit = self.max_per_type.get(rtype)
+        if limit is None and self._global is None:
+            self._unlimited.append((self._seq, resource))
+            return
+        entry = [-seen, -self._seq, resource, True]
+        type_heap = None
+        if limit is not None:
+            type_heap = self._heaps.get(rtype)
+            if type_heap is None:
+                type_heap = self._heaps[rtype] = _BoundedHeap(limit)
+            out = type_heap.push(entry)
+            if out is entry:
+                self.deferred[rtype] += 1
+                return
+            if out is not None:
+                if self._global is not None:
+                    self._global.remove(out)
+                self.deferred[rtype] += 1
+        if self._global is not None:
+            out = self._global.push(entry)
+            if out is not None:
+                out_type = out[2]["type"]
+                if out_type in self._heaps:
+                    self._heaps[out_type].remove(out)
+                self.deferred[out_type] += 1
+
+    def selected(self):
+        """
+        Return the resources to be deleted in the order they were offered.
+
+        :returns: List of resources
+        :rtype: list
+        """
+        if self._global is not None:
+            entries = self._global.live()
+        else:
+            entries = [
+                entry for heap in self._heaps.values() for entry in heap.live()
+            ]
+        selected = [(-entry[1], entry[2]) for entry in entries]
+        selected.extend(self._unlimited)
+        selected.sort(key=lambda entry: entry[0])
+        return [resource for _, resource in selected]
@@ -13,16 +13,93 @@
 #
 # Copyright: Red Hat Inc. 2025
 # Author: Lukas Doktor <ldoktor@redhat.com>
+import json
+import queue
 import sys
+import threading
 import time
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from pprint import pprint
 
 import yaml
 from dateutil.parser import isoparse
 
-from .awsweeper import AwsweeperRunner
+from .awsweeper import AwsweeperError, AwsweeperRunner
+from .budget import DeletionBudget
 from .io_utils import ResourceIO
+from .metrics import Metrics
+
+# Per-worker state of the parallel decision loop, see ``_init_worker``
+_WORKER = {}
+
+
+def _init_worker(settings, resources_dict, now):
+    """
+    Store the shared state in the worker process (shipped once per worker).
+
+    :param settings: Attributes of the cleaner used by the decision loop
+                     (see ``AwsResourceCleaner.WORKER_SETTINGS``)
+    :type settings: dict
+    :param resources_dict: Dictionary of existing resources and their seen
+                           counts
+    :param now: Timestamp of the current run
+    """
+    cleaner = AwsResourceCleaner(None)
+    for name, value in settings.items():
+        setattr(cleaner, name, value)
+    _WORKER["cleaner"] = cleaner
+    _WORKER["resources_dict"] = resources_dict
+    _WORKER["now"] = now
+
+
+def _process_worker_chunk(chunk):
+    """Process a chunk of awsweeper resources in a worker process"""
+    metrics = Metrics()
+    deletion = []
+    updated = _WORKER["cleaner"]._process_chunk(
+        _WORKER["resources_dict"],
+        chunk,
+        _WORKER["now"],
+        metrics,
+        lambda seen, resource: deletion.append((seen, resource)),
+    )
+    return updated, deletion, metrics
+
+
+class Decision(
+    namedtuple("Decision", ["kind", "resource", "seen", "tracked", "new"])
+):
+    """
+    Decision about a single awsweeper resource.
+
+    :ivar kind: One of ``KEEP``, ``NEW``, ``EXPIRED_SEEN``,
+                ``EXPIRED_CREATEDAT`` or ``SKIPPED_DEPENDENT``
+    :ivar resource: The awsweeper resource (with ``__seen__`` when tracked)
+    :ivar seen: Timestamp the age is computed from (``__seen__`` or
+                ``createdat``); None for skipped resources
+    :ivar tracked: Whether the resource belongs to the resources file
+    :ivar new: Whether the resource was seen for the first time
+    """
+
+    __slots__ = ()
+
+    KEEP = "keep"
+    NEW = "new"
+    EXPIRED_SEEN = "expired-by-seen"
+    EXPIRED_CREATEDAT = "expired-by-createdat"
+    SKIPPED_DEPENDENT = "skipped-dependent"
+
+    @property
+    def key(self):
+        """Resource key (type, id)"""
+        return self.resource["type"], self.resource["id"]
+
+    @property
+    def expired(self):
+        """Whether the resource should be deleted"""
+        return self.kind in (self.EXPIRED_SEEN, self.EXPIRED_CREATEDAT)
 
 
 class AwsResourceCleaner:
@@ -37,9 +114,27 @@ class AwsResourceCleaner:
     :ivar THRESHOLD: How long after the resource was seen for the first time
                      before it's set to be deleted.
     :vartype THRESHOLD: int
+    :ivar CHUNK_SIZE: Number of awsweeper resources processed by a worker
+                      at once when running in parallel.
+    :vartype CHUNK_SIZE: int
+    :ivar CLEANUP_BATCH: Number of cleanup entries serialized at once.
+    :vartype CLEANUP_BATCH: int
+    :ivar WORKER_SETTINGS: Attributes shipped to the worker processes (the
+                           rest of the state is not needed by the decision
+                           loop).
+    :vartype WORKER_SETTINGS: tuple
     """
 
     THRESHOLD = 172800
+    CHUNK_SIZE = 10000
+    CLEANUP_BATCH = 1000
+    WORKER_SETTINGS = (
+        "THRESHOLD",
+        "tag_regexps",
+        "policy",
+        "change_feed",
+        "_dependent_types",
+    )
 
     def __init__(
         self,
@@ -49,6 +144,22 @@ class AwsResourceCleaner:
         awsweeper_file=None,
         awsweeper_args=None,
         tag_regexps=None,
+        jobs=1,
+        checkpoint_dir=None,
+        awsweeper_regions=None,
+        awsweeper_config=None,
+        awsweeper_retries=0,
+        awsweeper_backoff=5.0,
+        checkpoint_max_age=3600,
+        cleanup_sinks=None,
+        cleanup_per_type=None,
+        metrics_file=None,
+        metrics_json_file=None,
+        max_deletions=None,
+        max_deletions_per_type=None,
+        policy=None,
+        change_feed=None,
+        scheduler=None,
     ):
         """
         Initialize the AwsResourceCleaner.
@@ -64,6 +175,53 @@ class AwsResourceCleaner:
         :type awsweeper_file: str, optional
         :param awsweeper_args: Arguments for awsweeper runner when used internally.
         :type awsweeper_args: dict, optional
+        :param tag_regexps: List of (age, compiled_regexp) overriding the age
+                            of matching resources.
+        :type tag_regexps: list, optional
+        :param jobs: Number of worker processes used to evaluate resources;
+                     1 keeps the single-process loop.
+        :type jobs: int, optional
+        :param checkpoint_dir: Directory to persist finished awsweeper units
+                               to in order to resume failed scans.
+        :type checkpoint_dir: str, optional
+        :param awsweeper_regions: Regions to be scanned as separate units.
+        :type awsweeper_regions: list, optional
+        :param awsweeper_config: awsweeper config file; when set each
+                                 resource type is scanned as a separate unit.
+        :type awsweeper_config: str, optional
+        :param awsweeper_retries: How many times to retry a failed unit.
+        :type awsweeper_retries: int, optional
+        :param awsweeper_backoff: Delay before the first retry of a unit.
+        :type awsweeper_backoff: float, optional
+        :param checkpoint_max_age: Maximum age of reusable checkpoints.
+        :type checkpoint_max_age: float, optional
+        :param cleanup_sinks: Extra files receiving the full cleanup list.
+        :type cleanup_sinks: list, optional
+        :param cleanup_per_type: Path template containing ``{type}`` used to
+                                 write the cleanup list of each type into a
+                                 separate file.
+        :type cleanup_per_type: str, optional
+        :param metrics_file: Path to write the run metrics to in
+                             OpenMetrics/Prometheus text format.
+        :type metrics_file: str, optional
+        :param metrics_json_file: Path to write the run metrics to as JSON.
+        :type metrics_json_file: str, optional
+        :param max_deletions: Only delete this many oldest expired resources
+                              per run; the rest is deferred to later runs.
+        :type max_deletions: int, optional
+        :param max_deletions_per_type: Limits of deletions per resource type.
+        :type max_deletions_per_type: dict, optional
+        :param policy: Per-type age policy.
+        :type policy: awscleaner.policy.Policy, optional
+        :param change_feed: Path to write the JSON-lines feed of resources
+                            that appeared, disappeared or became deletable
+                            since the previous run.
+        :type change_feed: str, optional
+        :param scheduler: Churn-aware scheduler of the scans per resource
+                          type (requires ``awsweeper_config``); types
+                          skipped by it are carried forward from the
+                          resources file.
+        :type scheduler: awscleaner.scheduler.ScanScheduler, optional
         """
         # awsweeper resource types dependent on another which can not be
         # cleaned independently.
@@ -74,6 +232,32 @@ class AwsResourceCleaner:
         self.awsweeper_file = awsweeper_file
         self.awsweeper_args = awsweeper_args
         self.tag_regexps = tag_regexps if tag_regexps is not None else []
+        self.jobs = jobs
+        self.checkpoint_dir = checkpoint_dir
+        self.awsweeper_regions = awsweeper_regions
+        self.awsweeper_config = awsweeper_config
+        self.awsweeper_retries = awsweeper_retries
+        self.awsweeper_backoff = awsweeper_backoff
+        self.checkpoint_max_age = checkpoint_max_age
+        self.cleanup_sinks = cleanup_sinks if cleanup_sinks is not None else []
+        self.cleanup_per_type = cleanup_per_type
+        self.metrics_file = metrics_file
+        self.metrics_json_file = metrics_json_file
+        self.max_deletions = max_deletions
+        self.max_deletions_per_type = max_deletions_per_type
+        self.policy = policy
+        self.change_feed = change_feed
+        # Keys marked as expired in the loaded resources (see change_feed)
+        self._expired_keys = set()
+        self.changes = []
+        self.scheduler = scheduler
+        # Types not scanned in this run and their resources loaded from the
+        # resources file (see scheduler)
+        self._carried_types = set()
+        self._carried = []
+        # Version of the loaded resources file (see ResourceIO.version)
+        self._resources_version = None
+        self.metrics = Metrics()
 
     def run(self):
         """
@@ -83,53 +267,219 @@ class AwsResourceCleaner:
         should be marked for deletion based on seen count thresholds, then saves updated
         resource data and the cleanup list.
 
+        Loading of the resources and the awsweeper scan (as well as saving
+        of the resources and the cleanup list) are independent and therefore
+        executed concurrently.
+
+        The metrics (when requested) are written even when the run fails.
+
         :returns: None
         """
-        resources = self._load_resources()
-        awsweeper_resources = self._load_awsweeper_resources()
+        self.metrics = Metrics()
+        timed = self.metrics.timed
+        bytes_read = ResourceIO.bytes_read
+        bytes_written = ResourceIO.bytes_written
+        try:
+            now = time.time()
+            scan_types = None
+            if self.scheduler is not None:
+                scan_types = set(
+                    AwsweeperRunner.load_config(self.awsweeper_config)
+                )
+                self.scheduler.load()
+                self._carried_types = self.scheduler.plan(scan_types, now)
+                scan_types -= self._carried_types
+
+            resources, awsweeper_resources = self._run_concurrently(
+                timed("load", self._load_resources),
+                timed(
+                    "scan",
+                    lambda: self._load_awsweeper_resources(scan_types),
+                ),
+                fail_fast=True,
+            )
+            scanned_resources = awsweeper_resources
+            if self._carried:
+                awsweeper_resources = awsweeper_resources + self._carried
+
+            updated_resources, deletion_list = timed(
+                "process", self._process_resources
+            )(resources, awsweeper_resources, now)
+            if self.scheduler is not None:
+                self.scheduler.update(
+                    scan_types,
+                    resources,
+                    scanned_resources,
+                    updated_resources,
+                    now,
+                )
 
-        updated_resources, deletion_list = self._process_resources(
-            resources, awsweeper_resources
-        )
+            self._run_concurrently(
+                timed(
+                    "save",
+                    lambda: self._save_resources(updated_resources, resources),
+                ),
+                timed("cleanup", lambda: self._save_cleanup(deletion_list)),
+                timed("changes", self._save_changes),
+                timed("schedule", self._save_schedule),
+            )
+        finally:
+            self.metrics.set("bytes_read", ResourceIO.bytes_read - bytes_read)
+            self.metrics.set(
+                "bytes_written", ResourceIO.bytes_written - bytes_written
+            )
+            self._save_metrics()
+
+    def _save_schedule(self):
+        """Save the scan schedule (if used)"""
+        if self.scheduler is None:
+            return
+        if self.dry_run:
+            print(
+                f"[DRY RUN] Not updating {self.scheduler.schedule_file}",
+                file=sys.stderr,
+            )
+        else:
+            self.scheduler.save()
+
+    def _save_metrics(self):
+        """Write the metrics to the metrics files (if specified)"""
+        if self.metrics_file:
+            self.metrics.write(
+                self.metrics_file, self.metrics.to_openmetrics()
+            )
+        if self.metrics_json_file:
+            self.metrics.write(self.metrics_json_file, self.metrics.to_json())
+
+    @staticmethod
+    def _run_concurrently(*funcs, fail_fast=False):
+        """
+        Execute the functions in threads and wait for all of them.
+
+        All functions are always finished before reporting the failure of
+        the first failing one (in the order of arguments). With
+        ``fail_fast`` the first failure (in the order of occurrence) is
+        reported immediately; the remaining functions are left running in
+        daemon threads which do not delay the interpreter exit, therefore
+        only use it for functions that are safe to abandon (eg. reads).
+
+        :param funcs: Functions (without arguments) to be executed
+        :param fail_fast: Report the first failure without waiting for
+                          the other functions
+        :type fail_fast: bool
+        :returns: List of the return values (in the order of arguments)
+        :rtype: list
+        """
+        if not fail_fast:
+            with ThreadPoolExecutor(max_workers=len(funcs)) as executor:
+                futures = [executor.submit(func) for func in funcs]
+            # The executor waits for all futures; result() re-raises the
+            # exceptions (including SystemExit) in the main thread
+            return [future.result() for future in futures]
+
+        results = [None] * len(funcs)
+        finished = queue.Queue()
+
+        def call(i, func):
+            try:
+                results[i] = func()
+            except BaseException as exc:  # including SystemExit
+                finished.put(exc)
+            else:
+                finished.put(None)
 
-        self._save_resources(updated_resources)
-        self._save_cleanup(deletion_list)
+        for i, func in enumerate(funcs):
+            threading.Thread(target=call, args=(i, func), daemon=True).start()
+        for _ in funcs:
+            exc = finished.get()
+            if exc is not None:
+                raise exc
+        return results
 
     def _load_resources(self):
         """
         Load existing resources from file.
 
+        Only the needed fields are extracted (see ``ResourceIO.iter_records``)
+        except of the carried forward types (see ``scheduler``) which are
+        loaded completely into ``_carried``.
+
         :returns: A dictionary mapping resource keys (type, id) to their seen counts.
         :rtype: dict
         """
-        resources = ResourceIO.load(self.resources_file)
-        return {(r["type"], r["id"]): r.get("__seen__", 0) for r in resources}
-
-    def _load_awsweeper_resources(self):
+        resources = {}
+        expired_keys = set()
+        carried = []
+        # Taken before loading, a concurrent change only causes a merge
+        self._resources_version = ResourceIO.version(self.resources_file)
+        for r in ResourceIO.iter_records(
+            self.resources_file,
+            {"type", "id", "__seen__", "__expired__"},
+            self._carried_types,
+        ):
+            key = (r["type"], r["id"])
+            resources[key] = r.get("__seen__", 0)
+            if r.pop("__expired__", False):
+                expired_keys.add(key)
+            if key[0] in self._carried_types:
+                carried.append(r)
+        self._expired_keys = expired_keys
+        self._carried = carried
+        return resources
+
+    def _load_awsweeper_resources(self, types=None):
         """
         Load awsweeper resource data.
 
         If an awsweeper file is specified, load from that. Otherwise,
-        execute the AwsweeperRunner to get current resource data.
+        execute the AwsweeperRunner to get current resource data (split into
+        units when regions or checkpoint dir are set, see
+        ``AwsweeperRunner.run_checkpointed``).
+
+        :param types: Only scan these types of the ``awsweeper_config``
+        :type types: set, optional
 
         :returns: List of resource dictionaries from awsweeper.
         :rtype: list
         """
         if self.awsweeper_file:
             return ResourceIO.load(self.awsweeper_file)
-        return AwsweeperRunner.run(self.awsweeper_args)
-
-    def _get_deadline(self, resource, default_deadline):
+        try:
+            ret = AwsweeperRunner.run_checkpointed(
+                self.awsweeper_args,
+                checkpoint_dir=self.checkpoint_dir,
+                regions=self.awsweeper_regions,
+                config=self.awsweeper_config,
+                retries=self.awsweeper_retries,
+                backoff=self.awsweeper_backoff,
+                types=types,
+                checkpoint_max_age=self.checkpoint_max_age,
+            )
+        except AwsweeperError as e:
+            self.metrics.set("awsweeper_exit_status", e.returncode)
+            print(e, file=sys.stderr)
+            sys.exit(1)
+        self.metrics.set("awsweeper_exit_status", 0)
+        return ret
+
+    def _get_deadline(self, resource, default_deadline, now, metrics=None):
         """
-        Get deadline based on the resource and the tag regexps
+        Get deadline based on the resource, the tag regexps and the policy
+
+        The lowest age of the matching tag regexps and policy rules wins;
+        when none matches the policy default age of the resource type is
+        used.
 
         :param resource: resource dict
         :param default_deadline: default deadline (when no rule applies)
+        :param now: Timestamp of the current run
+        :param metrics: Metrics to account the rule matches to
         :return: Deadline - older resources than this datetime should be
                  removed
         :rtype: number
         """
         threshold = None
+        matched = set()
         tags = list(resource.get("tags", {}).items())
         rid = resource.get("id")
         if rid:
@@ -139,6 +489,7 @@ class AwsResourceCleaner:
             tvalue = tvalue if isinstance(tvalue, str) else ""
             for rule, regexp in self.tag_regexps:
                 if regexp.match(tkey) or regexp.match(tvalue):
+                    matched.add(f"{rule}:{regexp.pattern}")
                     if threshold is None:
                         print(
                             f"Overriding threshold to {rule}", file=sys.stderr
@@ -149,11 +500,23 @@ class AwsResourceCleaner:
                             f"Overriding threshold to {rule}", file=sys.stderr
                         )
                         threshold = rule
+        if metrics is not None:
+            for rule in matched:
+                metrics.inc("rule_matches", rule=rule)
+        if self.policy is not None:
+            rule = self.policy.match(resource, metrics)
+            if rule is not None and (threshold is None or threshold > rule):
+                print(f"Overriding threshold to {rule}", file=sys.stderr)
+                threshold = rule
+            if threshold is None:
+                threshold = self.policy.type_ages.get(resource["type"])
         if threshold is None:
             return default_deadline
-        return time.time() - threshold
+        return now - threshold
 
-    def _process_resources(self, resources_dict, awsweeper_resources):
+    def _process_resources(
+        self, resources_dict, awsweeper_resources, now=None
+    ):
         """
         Process AWS resources to determine which should be deleted.
 
@@ -161,28 +524,173 @@ class AwsResourceCleaner:
         if the count exceeds the threshold. Also handles resources with a "createdat"
         field by immediately marking them for deletion.
 
+        When ``jobs`` is greater than 1 the resources are split into chunks
+        of ``CHUNK_SIZE`` and evaluated in a process pool. The results are
+        merged in the chunk order, therefore the output is identical to the
+        single-process path.
+
+        The deletion list is limited by ``max_deletions`` and
+        ``max_deletions_per_type`` keeping only the oldest resources; the
+        deferred ones stay tracked for the next run.
+
         :param resources_dict: Dictionary of existing resources and their seen counts.
         :type resources_dict: dict
         :param awsweeper_resources: List of resources from awsweeper output.
         :type awsweeper_resources: list
+        :param now: Timestamp of the current run (defaults to ``time.time()``)
+        :type now: float, optional
 
         :returns: A tuple containing updated resource list and the deletion list.
         :rtype: tuple
         """
+        if now is None:
+            now = time.time()
+        budget = DeletionBudget(
+            self.max_deletions, self.max_deletions_per_type
+        )
+        if self.jobs <= 1 or len(awsweeper_resources) <= self.CHUNK_SIZE:
+            updated_resources = self._process_chunk(
+                resources_dict,
+                awsweeper_resources,
+                now,
+                self.metrics,
+                budget.offer,
+            )
+            return self._finish_processing(
+                resources_dict, updated_resources, budget
+            )
+
+        chunks = [
+            awsweeper_resources[i : i + self.CHUNK_SIZE]
+            for i in range(0, len(awsweeper_resources), self.CHUNK_SIZE)
+        ]
         updated_resources = {}
-        deletion_list = []
-        default_deadline = time.time() - self.THRESHOLD
+        with ProcessPoolExecutor(
+            max_workers=self.jobs,
+            initializer=_init_worker,
+            initargs=(
+                {name: getattr(self, name) for name in self.WORKER_SETTINGS},
+                resources_dict,
+                now,
+            ),
+        ) as executor:
+            # map() yields results in the submission order
+            for updated, deletion, metrics in executor.map(
+                _process_worker_chunk, chunks
+            ):
+                updated_resources.update(updated)
+                for seen, resource in deletion:
+                    budget.offer(seen, resource)
+                self.metrics.merge(metrics)
+        return self._finish_processing(
+            resources_dict, updated_resources, budget
+        )
+
+    def _finish_processing(self, resources_dict, updated_resources, budget):
+        """
+        Account the per-type totals and produce the processing result.
+
+        When ``change_feed`` is set, the changes against the loaded
+        resources are collected into ``changes`` as well.
+
+        :param resources_dict: Dictionary of existing resources and their seen counts.
+        :type resources_dict: dict
+        :param updated_resources: Updated resources dict (keyed by (type, id))
+        :type updated_resources: dict
+        :param budget: Deletion budget holding the expired resources
+        :type budget: DeletionBudget
+        :returns: A tuple containing updated resource list and the deletion list.
+        :rtype: tuple
+        """
+        changes = []
+        for key, r in updated_resources.items():
+            self.metrics.inc("resources", type=key[0], state="tracked")
+            if not self.change_feed:
+                continue
+            if key not in resources_dict:
+                changes.append(self._change("appeared", r))
+            if r.get("__expired__") and key not in self._expired_keys:
+                changes.append(self._change("deletable", r))
+        if self.change_feed:
+            for key, seen in resources_dict.items():
+                if key not in updated_resources:
+                    changes.append(
+                        self._change(
+                            "disappeared",
+                            {"type": key[0], "id": key[1], "__seen__": seen},
+                        )
+                    )
+        self.changes = changes
+        deletion_list = budget.selected()
+        if budget.deferred:
+            for rtype, count in budget.deferred.items():
+                self.metrics.inc(
+                    "resources", count, type=rtype, state="deferred"
+                )
+            details = ", ".join(
+                f"{rtype}: {count}"
+                for rtype, count in sorted(budget.deferred.items())
+            )
+            print(
+                f"Deferred {sum(budget.deferred.values())} deletions to the "
+                f"next run due to the deletion budget ({details})",
+                file=sys.stderr,
+            )
+        return list(updated_resources.values()), deletion_list
+
+    @staticmethod
+    def _change(event, resource):
+        """Create change feed entry"""
+        return {
+            "event": event,
+            "type": resource["type"],
+            "id": resource["id"],
+            "seen": resource.get("__seen__"),
+        }
+
+    def iter_decisions(
+        self, resources_dict, awsweeper_resources, now=None, metrics=None
+    ):
+        """
+        Evaluate awsweeper resources one by one.
+
+        This is the streaming counterpart of ``run`` for library callers;
+        nothing but the current resource is held in memory so the decisions
+        can be piped into custom sinks (eg. :class:`StateWriter`). Duplicate
+        keys are yielded as they come; ``run`` keeps the last occurrence of
+        each resource.
+
+        :param resources_dict: Dictionary of existing resources and their
+                               seen counts (see ``ResourceIO.load_state``)
+        :type resources_dict: dict
+        :param awsweeper_resources: Iterable of resources from awsweeper output.
+        :type awsweeper_resources: iterable
+        :param now: Timestamp of the current run (defaults to ``time.time()``)
+        :type now: float, optional
+        :param metrics: Metrics to account the rule matches and createdat
+                        parse failures to
+        :type metrics: Metrics, optional
+
+        :returns: Iterator of decisions
+        :rtype: iterator of :class:`Decision`
+        """
+        if now is None:
+            now = time.time()
+        default_deadline = now - self.THRESHOLD
         # Avoid going through tags if no rules defined
-        if not self.tag_regexps:
-            get_deadline = lambda _1, _2: default_deadline
+        if not self.tag_regexps and self.policy is None:
+            get_deadline = lambda _1, _2, _3, _4: default_deadline
         else:
             get_deadline = self._get_deadline
 
         for r in awsweeper_resources:
             if r["type"] in self._dependent_types:
+                yield Decision(
+                    Decision.SKIPPED_DEPENDENT, r, None, False, False
+                )
                 continue
             key = (r["type"], r["id"])
-            deadline = get_deadline(r, default_deadline)
+            deadline = get_deadline(r, default_deadline, now, metrics)
 
             if r.get("createdat") is not None:
                 try:
@@ -192,31 +700,99 @@ class AwsResourceCleaner:
                     seen = seen.timestamp()
                     if seen < deadline:
                         pprint(r, sys.stderr)
-                        deletion_list.append(r)
+                        yield Decision(
+                            Decision.EXPIRED_CREATEDAT, r, seen, False, False
+                        )
                         continue
+                    yield Decision(Decision.KEEP, r, seen, False, False)
                     continue
                 except ValueError:
                     print(f"Unable to parse createdat of {r}", file=sys.stderr)
+                    if metrics is not None:
+                        metrics.inc("createdat_parse_failures")
 
             seen = resources_dict.get(key, None)
-            if seen is None:
+            new = seen is None
+            if new:
                 print(f"Adding __seen__ to {r}", file=sys.stderr)
-                seen = time.time()
-                r["__seen__"] = seen
+                seen = now
+            r["__seen__"] = seen
             if seen < deadline:
                 pprint(r, sys.stderr)
-                deletion_list.append(r)
-            r["__seen__"] = seen
-            updated_resources[key] = r
+                yield Decision(Decision.EXPIRED_SEEN, r, seen, True, new)
+            elif new:
+                yield Decision(Decision.NEW, r, seen, True, True)
+            else:
+                yield Decision(Decision.KEEP, r, seen, True, False)
 
-        return list(updated_resources.values()), deletion_list
+    def _process_chunk(
+        self, resources_dict, awsweeper_resources, now, metrics, offer
+    ):
+        """
+        Evaluate a chunk of awsweeper resources.
+
+        :param resources_dict: Dictionary of existing resources and their seen counts.
+        :type resources_dict: dict
+        :param awsweeper_resources: List of resources from awsweeper output.
+        :type awsweeper_resources: list
+        :param now: Timestamp of the current run
+        :type now: float
+        :param metrics: Metrics to account the decisions to
+        :type metrics: Metrics
+        :param offer: Function called with (seen, resource) of each expired
+                      resource
+        :type offer: callable
+
+        :returns: Updated resources dict (keyed by (type, id))
+        :rtype: dict
+        """
+        updated_resources = {}
+        for decision in self.iter_decisions(
+            resources_dict, awsweeper_resources, now, metrics
+        ):
+            if decision.kind == Decision.SKIPPED_DEPENDENT:
+                metrics.inc(
+                    "resources",
+                    type=decision.resource["type"],
+                    state="skipped_dependent",
+                )
+                continue
+            if decision.new:
+                metrics.inc(
+                    "resources", type=decision.resource["type"], state="new"
+                )
+            if decision.expired:
+                metrics.inc(
+                    "resources",
+                    type=decision.resource["type"],
+                    state="expired",
+                )
+                offer(decision.seen, decision.resource)
+                if self.change_feed and decision.tracked:
+                    # Remember it was deletable for the next change feed
+                    decision.resource["__expired__"] = True
+            if decision.tracked:
+                updated_resources[decision.key] = decision.resource
+
+        return updated_resources
 
-    def _save_resources(self, updated_resources):
+    def _save_resources(self, updated_resources, loaded_resources=None):
         """
         Save the updated resource data to file.
 
+        The file is updated under a lock (or conditionally on S3) and merged
+        with its current content so concurrent runs do not lose updates:
+        resources added by others since we loaded the file are preserved
+        and the earliest ``__seen__`` wins for resources tracked by both.
+        The merge is skipped when the file was not changed since it was
+        loaded.
+
         :param updated_resources: List of updated resource dictionaries.
         :type updated_resources: list
+        :param loaded_resources: Resources loaded at the beginning of the run
+                                 (see ``_load_resources``); these are not
+                                 preserved unless seen in this run.
+        :type loaded_resources: dict, optional
         """
         if self.dry_run:
             print(
@@ -224,29 +800,146 @@ class AwsResourceCleaner:
                 file=sys.stderr,
             )
         else:
-            ResourceIO.dump(self.resources_file, updated_resources)
+            ResourceIO.update_streamed(
+                self.resources_file,
+                lambda current: self._merge_resources(
+                    updated_resources, loaded_resources or {}, current
+                ),
+                self._resources_version,
+            )
 
-    def _save_cleanup(self, deletion_list):
+    @staticmethod
+    def _merge_resources(updated_resources, loaded_resources, current):
         """
-        Save the cleanup list to file and print it in YAML format.
+        Merge our updated resources with the current content of the file.
+
+        The current content is streamed twice by ``ResourceIO.iter_records``;
+        only the keys and ``__seen__`` are extracted in the first pass and
+        the resources added by others are loaded completely in the second
+        one (only when there are some).
+
+        :param updated_resources: List of updated resource dictionaries.
+        :type updated_resources: list
+        :param loaded_resources: Resources loaded at the beginning of the run
+        :type loaded_resources: dict
+        :param current: Path to the current content of the resources file
+                        (None when there is nothing to merge)
+        :type current: str or None
+        :returns: Merged list of resources
+        :rtype: list
+        """
+        if not current:
+            return updated_resources
+        ours = {(r["type"], r["id"]): r for r in updated_resources}
+        foreign = set()
+        for r in ResourceIO.iter_records(current, {"type", "id", "__seen__"}):
+            key = (r.get("type"), r.get("id"))
+            if key in ours:
+                seen = r.get("__seen__")
+                if seen is not None and seen < ours[key]["__seen__"]:
+                    ours[key]["__seen__"] = seen
+            elif key not in loaded_resources:
+                foreign.add(key)
+        merged = list(updated_resources)
+        if foreign:
+            for r in ResourceIO.iter_records(
+                current, {"type", "id"}, {key[0] for key in foreign}
+            ):
+                key = (r.get("type"), r.get("id"))
+                if key in foreign:
+                    foreign.remove(key)
+                    merged.append(r)
+        return merged
+
+    def _save_changes(self):
+        """
+        Write the collected changes as JSON lines to the change feed.
+
+        Tracked resources are compared against the loaded resources; the
+        ``createdat`` based expirations are stateless and not part of the
+        feed.
+        """
+        if not self.change_feed:
+            return
+        if self.dry_run:
+            print(f"[DRY RUN] Not writing {self.change_feed}", file=sys.stderr)
+            return
+        with ResourceIO.open_writer(self.change_feed) as stream:
+            for change in self.changes:
+                stream.write(json.dumps(change).encode() + b"\n")
+
+    def _iter_cleanup(self, deletion_list):
+        """
+        Serialize the grouped cleanup list as a stream of YAML chunks.
 
-        Groups resources by type before saving. If a cleanup file is specified,
-        writes the grouped data there as well.
+        Resources are grouped by type (sorted) and each group is serialized
+        in batches of ``CLEANUP_BATCH`` entries, therefore the output is
+        never built as one big string.
 
         :param deletion_list: List of resource dictionaries marked for deletion.
         :type deletion_list: list
+        :returns: Iterator of tuple(type, bytes); type is None for the empty
+                  document
         """
         grouped = defaultdict(list)
         for r in deletion_list:
-            grouped[r["type"]].append({"id": r["id"]})
+            grouped[r["type"]].append(r["id"])
+        if not grouped:
+            yield None, b"{}\n"
+            return
+        for rtype in sorted(grouped):
+            ids = grouped[rtype]
+            for i in range(0, len(ids), self.CLEANUP_BATCH):
+                batch = [
+                    {"id": rid} for rid in ids[i : i + self.CLEANUP_BATCH]
+                ]
+                # Follow-up batches are plain sequence items which continue
+                # the non-indented block sequence of the type
+                data = batch if i else {rtype: batch}
+                yield rtype, yaml.dump(data, default_flow_style=False).encode()
 
-        print(yaml.dump(dict(grouped)))
+    def _save_cleanup(self, deletion_list):
+        """
+        Save the cleanup list to file and print it in YAML format.
 
-        if self.cleanup_file:
-            if self.dry_run:
-                print(
-                    f"[DRY RUN] Not writing {self.cleanup_file}",
-                    file=sys.stderr,
-                )
-            else:
-                ResourceIO.dump(self.cleanup_file, dict(grouped))
+        Groups resources by type before saving. The grouped output is
+        serialized once and written to stdout, the cleanup file (if
+        specified), the extra cleanup sinks and the per-type files.
+
+        :param deletion_list: List of resource dictionaries marked for deletion.
+        :type deletion_list: list
+        """
+        sinks = [self.cleanup_file] if self.cleanup_file else []
+        sinks.extend(self.cleanup_sinks)
+        per_type = self.cleanup_per_type
+        if self.dry_run:
+            for sink in sinks + ([per_type] if per_type else []):
+                print(f"[DRY RUN] Not writing {sink}", file=sys.stderr)
+            sinks = []
+            per_type = None
+
+        stdout = sys.stdout
+        if hasattr(stdout, "buffer"):
+            stdout.flush()
+            write_stdout = stdout.buffer.write
+        else:
+            # Text-only streams (eg. io.StringIO via redirect_stdout)
+            write_stdout = lambda chunk: stdout.write(chunk.decode())
+        with ExitStack() as stack:
+            writers = [
+                stack.enter_context(ResourceIO.open_writer(sink))
+                for sink in sinks
+            ]
+            type_writers = {}
+            for rtype, chunk in self._iter_cleanup(deletion_list):
+                write_stdout(chunk)
+                for writer in writers:
+                    writer.write(chunk)
+                if per_type and rtype is not None:
+                    if rtype not in type_writers:
+                        type_writers[rtype] = stack.enter_context(
+                            ResourceIO.open_writer(per_type.format(type=rtype))
+                        )
+                    type_writers[rtype].write(chunk)
+            if hasattr(stdout, "buffer"):
+                stdout.buffer.flush()
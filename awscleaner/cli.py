@@ -18,24 +18,29 @@ import re
 import shlex
 
 from .cleaner import AwsResourceCleaner
+from .policy import Policy
+from .scheduler import ScanScheduler
 
 
 def parse_age(value: str) -> float:
-    """Parse age string with optional suffix (s/m/h/d/M/Y) into seconds as float."""
+    """Parse age string with optional suffix (s/m/h/D/M/Y) into seconds as float.
+
+    Only ``m`` (minute) and ``M`` (month) are case-sensitive.
+    """
     # Define multipliers for each unit (in seconds)
     units = {
         "s": 1.0,  # second
         "m": 60.0,  # minute
         "h": 3600.0,  # hour
         "d": 86400.0,  # day
-        "m": 2592000.0,  # month (approx 30 days)
+        "M": 2592000.0,  # month (approx 30 days)
         "y": 31536000.0,  # year (approx 365 days)
     }
 
     # Extract last character as unit, if valid
-    if len(value) > 1 and value[-1].lower() in units:
+    unit = value[-1:] if value[-1:] in "mM" else value[-1:].lower()
+    if len(value) > 1 and unit in units:
         num = float(value[:-1])  # all but last char
-        unit = value[-1].lower()
     else:
         num = float(value)  # no suffix, assume seconds
         unit = "s"  # default to seconds
@@ -49,6 +54,12 @@ def parse_regexp(value: str) -> tuple:
     return (parse_age(age), re.compile(regexp))
 
 
+def parse_type_limit(value: str) -> tuple:
+    """Parses TYPE:N item into tuple(type, limit)"""
+    rtype, limit = value.rsplit(":", 1)
+    return (rtype, int(limit))
+
+
 def main():
     """
     Main entry point for the AWS resource cleaner command-line tool.
@@ -103,7 +114,140 @@ def main():
         type=parse_regexp,
     )
 
+    parser.add_argument(
+        "--jobs",
+        help="Number of worker processes used to evaluate the resources "
+        "(useful for very large inventories)",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--awsweeper-config",
+        help="awsweeper config file; with '--checkpoint-dir' each resource "
+        "type is scanned separately (do not pass it via '--awsweeper-args')",
+    )
+    parser.add_argument(
+        "--awsweeper-regions",
+        help="Scan each of these regions separately (adds '--region')",
+        nargs="*",
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        help="Persist finished awsweeper units (region/type) here so a "
+        "failed scan can be resumed by rerunning the same command",
+    )
+    parser.add_argument(
+        "--checkpoint-max-age",
+        help="Discard checkpoints older than this, optional suffix smhDMY "
+        "(%(default)s)",
+        type=parse_age,
+        default=3600.0,
+    )
+    parser.add_argument(
+        "--awsweeper-retries",
+        help="How many times to retry a failed awsweeper unit (%(default)s)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--awsweeper-backoff",
+        help="Delay before retrying a failed unit, doubled on each retry, "
+        "optional suffix smhDMY (%(default)s)",
+        type=parse_age,
+        default=5.0,
+    )
+
+    parser.add_argument(
+        "--cleanup-sinks",
+        help="Extra paths (or s3:// URIs) to write the cleanup list to",
+        nargs="*",
+    )
+    parser.add_argument(
+        "--cleanup-per-type",
+        help="Path template to write the cleanup list of each resource type "
+        "to a separate file, eg. 'cleanup-{type}.yaml'",
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        help="Write the run metrics in OpenMetrics/Prometheus text format "
+        "(eg. for node-exporter's textfile collector, use '.prom' suffix)",
+    )
+    parser.add_argument(
+        "--metrics-json-file",
+        help="Write the run metrics in JSON format",
+    )
+
+    parser.add_argument(
+        "--max-deletions",
+        help="Only delete the N oldest expired resources per run, the rest "
+        "is deferred to the next runs",
+        type=int,
+    )
+    parser.add_argument(
+        "--max-deletions-type",
+        help="Limit deletions per resource type, eg. 'aws_instance:100'",
+        nargs="*",
+        type=parse_type_limit,
+        default=[],
+    )
+
+    parser.add_argument(
+        "--policy",
+        help="Path to YAML policy file (or s3:// URI) defining default age "
+        "per resource type and exact/regexp tag rules scoped to types or tag "
+        "keys (see awscleaner.policy.Policy)",
+    )
+
+    parser.add_argument(
+        "--change-feed",
+        help="Write JSON lines of resources that appeared, disappeared or "
+        "became deletable since the previous run (path or s3:// URI)",
+    )
+
+    parser.add_argument(
+        "--schedule-file",
+        help="Track per-type churn in this file (path or s3:// URI) and "
+        "rescan stable types less often, carrying their resources forward "
+        "from the resources file (requires '--awsweeper-config')",
+    )
+    parser.add_argument(
+        "--max-staleness",
+        help="Maximum time between scans of a stable type, optional suffix "
+        "smhDMY (%(default)s)",
+        type=parse_age,
+        default=604800.0,
+    )
+    parser.add_argument(
+        "--churn-threshold",
+        help="Fraction of changed resources per scan below which a type is "
+        "considered stable (%(default)s)",
+        type=float,
+        default=0.01,
+    )
+    parser.add_argument(
+        "--volatile-types",
+        help="Resource types to be scanned on every run regardless of churn",
+        nargs="*",
+    )
+
     args = parser.parse_args()
+    if args.schedule_file and (
+        not args.awsweeper_config or args.awsweeper_file
+    ):
+        parser.error(
+            "--schedule-file requires --awsweeper-config and can not be "
+            "used with --awsweeper-file"
+        )
+    scheduler = None
+    if args.schedule_file:
+        scheduler = ScanScheduler(
+            args.schedule_file,
+            args.max_staleness,
+            args.churn_threshold,
+            args.volatile_types,
+        )
 
     cleaner = AwsResourceCleaner(
         resources_file=args.resources_file,
@@ -112,6 +256,22 @@ def main():
         awsweeper_file=args.awsweeper_file,
         awsweeper_args=args.awsweeper_args,
         tag_regexps=args.tag_regexps,
+        jobs=args.jobs,
+        checkpoint_dir=args.checkpoint_dir,
+        awsweeper_regions=args.awsweeper_regions,
+        awsweeper_config=args.awsweeper_config,
+        awsweeper_retries=args.awsweeper_retries,
+        awsweeper_backoff=args.awsweeper_backoff,
+        checkpoint_max_age=args.checkpoint_max_age,
+        cleanup_sinks=args.cleanup_sinks,
+        cleanup_per_type=args.cleanup_per_type,
+        metrics_file=args.metrics_file,
+        metrics_json_file=args.metrics_json_file,
+        max_deletions=args.max_deletions,
+        max_deletions_per_type=dict(args.max_deletions_type),
+        policy=Policy.load(args.policy, parse_age) if args.policy else None,
+        change_feed=args.change_feed,
+        scheduler=scheduler,
     )
     if isinstance(args.age, float):
         cleaner.THRESHOLD = args.age
@@ -13,9 +13,14 @@
 #
 # Copyright: Red Hat Inc. 2025
 # Author: Lukas Doktor <ldoktor@redhat.com>
+import fcntl
 import os
+import shutil
 import sys
 import tempfile
+import threading
+import time
+from contextlib import contextmanager
 
 import yaml
 
@@ -29,7 +34,32 @@ except ImportError:
 
 
 class ResourceIO:
-    """Handles loading and saving resources from/to YAML files and S3."""
+    """
+    Handles loading and saving resources from/to YAML files and S3.
+
+    Local files are always replaced atomically (temporary file + rename) and
+    :meth:`update` allows concurrent read-modify-write cycles (advisory
+    file locks for local files, ETag-conditional writes for S3).
+
+    :ivar UPDATE_RETRIES: How many times to retry conflicting S3 updates
+    :vartype UPDATE_RETRIES: int
+    :ivar bytes_read: Number of bytes read so far
+    :vartype bytes_read: int
+    :ivar bytes_written: Number of bytes written so far
+    :vartype bytes_written: int
+    """
+
+    UPDATE_RETRIES = 10
+    bytes_read = 0
+    bytes_written = 0
+    _stats_lock = threading.Lock()
+
+    @staticmethod
+    def _count(read=0, written=0):
+        """Account the transferred bytes (thread-safe)"""
+        with ResourceIO._stats_lock:
+            ResourceIO.bytes_read += read
+            ResourceIO.bytes_written += written
 
     @staticmethod
     def load(filename: str):
@@ -45,8 +75,215 @@ class ResourceIO:
         if filename.startswith("s3://"):
             return ResourceIO._load_from_s3(filename)
         with open(filename, "r") as f:
+            ResourceIO._count(read=os.fstat(f.fileno()).st_size)
             return yaml.safe_load(f)
 
+    @staticmethod
+    def iter_records(filename: str, fields, full_types=None):
+        """
+        Selectively load records of a YAML list of mappings.
+
+        The file is walked at the parser event level and only the scalar
+        values of the specified top-level ``fields`` are constructed; nested
+        content (eg. tags) is skipped without being built, so the memory
+        and parse time depend on the number of records rather than on the
+        payload size.
+
+        Records whose "type" is in ``full_types`` are returned complete
+        (cheapest when "type" precedes the other keys, which is the case of
+        files written by awscleaner).
+
+        :param filename: The path to the file or the S3 URI (e.g., 's3://bucket/key')
+        :type filename: str
+        :param fields: Names of the fields to extract
+        :type fields: set
+        :param full_types: Types of records to be loaded completely
+        :type full_types: set, optional
+        :returns: Iterator of dicts with the present fields of each record
+        """
+        if filename.startswith("s3://"):
+            bucket_name, key = ResourceIO._parse_s3_path(filename)
+            temp_file = tempfile.NamedTemporaryFile(delete=False)
+            temp_file.close()
+            try:
+                try:
+                    s3_client = boto3.client("s3")
+                    s3_client.download_file(bucket_name, key, temp_file.name)
+                except ClientError as e:
+                    print(f"Error downloading from S3: {e}", file=sys.stderr)
+                    sys.exit(1)
+                yield from ResourceIO.iter_records(
+                    temp_file.name, fields, full_types
+                )
+            finally:
+                os.remove(temp_file.name)
+            return
+        with open(filename, "r") as f:
+            ResourceIO._count(read=os.fstat(f.fileno()).st_size)
+            yield from ResourceIO._iter_yaml_records(f, fields, full_types)
+
+    @staticmethod
+    def load_state(filename: str):
+        """
+        Load the tracked resources of a resources file.
+
+        Thin wrapper over :meth:`iter_records` producing the
+        ``resources_dict`` of :meth:`AwsResourceCleaner.iter_decisions`.
+
+        :param filename: The path to the file or the S3 URI (e.g., 's3://bucket/key')
+        :type filename: str
+        :returns: Mapping of (type, id) to ``__seen__``
+        :rtype: dict
+        """
+        return {
+            (r["type"], r["id"]): r.get("__seen__", 0)
+            for r in ResourceIO.iter_records(
+                filename, {"type", "id", "__seen__"}
+            )
+        }
+
+    @staticmethod
+    def _iter_yaml_records(stream, fields, full_types=None):
+        """
+        Walk YAML events of a list of mappings extracting the ``fields``.
+
+        :param stream: Opened YAML stream
+        :param fields: Names of the fields to extract
+        :type fields: set
+        :param full_types: Types of records to be loaded completely
+        :type full_types: set, optional
+        :returns: Iterator of dicts with the present fields of each record
+        """
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)(stream)
+        try:
+            loader.get_event()  # StreamStartEvent
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+            loader.get_event()  # DocumentStartEvent
+            if not loader.check_event(yaml.SequenceStartEvent):
+                # Empty document (null) or unsupported content
+                ResourceIO._skip_node(loader)
+                return
+            loader.get_event()
+            while not loader.check_event(yaml.SequenceEndEvent):
+                if not loader.check_event(yaml.MappingStartEvent):
+                    ResourceIO._skip_node(loader)
+                    continue
+                loader.get_event()
+                record = {}
+                # Complete record, built only while it might be needed
+                full = {} if full_types else None
+                anchors = {}
+                while not loader.check_event(yaml.MappingEndEvent):
+                    if (
+                        full is not None
+                        and "type" in record
+                        and record["type"] not in full_types
+                    ):
+                        full = None
+                    key = loader.peek_event()
+                    if (
+                        isinstance(key, yaml.ScalarEvent)
+                        and key.value in fields
+                    ):
+                        loader.get_event()
+                        if loader.check_event(yaml.ScalarEvent):
+                            value = ResourceIO._construct_scalar(
+                                loader, loader.get_event()
+                            )
+                            record[key.value] = value
+                            if full is not None:
+                                full[key.value] = value
+                            continue
+                        if full is not None:
+                            full[key.value] = ResourceIO._build_node(
+                                loader, loader.get_event(), anchors
+                            )
+                            continue
+                    elif full is not None:
+                        rkey = ResourceIO._build_node(
+                            loader, loader.get_event(), anchors
+                        )
+                        full[rkey] = ResourceIO._build_node(
+                            loader, loader.get_event(), anchors
+                        )
+                        continue
+                    else:
+                        ResourceIO._skip_node(loader)
+                    ResourceIO._skip_node(loader)
+                loader.get_event()
+                if full is not None and record.get("type") in full_types:
+                    yield full
+                else:
+                    yield record
+        finally:
+            loader.dispose()
+
+    @staticmethod
+    def _skip_node(loader):
+        """Consume events of the next node (including nested ones)"""
+        event = loader.get_event()
+        if not isinstance(event, yaml.CollectionStartEvent):
+            return
+        depth = 1
+        while depth:
+            event = loader.get_event()
+            if isinstance(event, yaml.CollectionStartEvent):
+                depth += 1
+            elif isinstance(event, yaml.CollectionEndEvent):
+                depth -= 1
+
+    @staticmethod
+    def _build_node(loader, event, anchors):
+        """
+        Construct python value of the node starting by the (consumed) event
+
+        :param loader: YAML loader
+        :param event: The first event of the node
+        :param anchors: Mapping of anchors to already built values
+        :returns: The constructed value
+        """
+        if isinstance(event, yaml.AliasEvent):
+            return anchors.get(event.anchor)
+        if isinstance(event, yaml.ScalarEvent):
+            value = ResourceIO._construct_scalar(loader, event)
+        elif isinstance(event, yaml.SequenceStartEvent):
+            value = []
+            while not loader.check_event(yaml.SequenceEndEvent):
+                value.append(
+                    ResourceIO._build_node(loader, loader.get_event(), anchors)
+                )
+            loader.get_event()
+        else:
+            value = {}
+            while not loader.check_event(yaml.MappingEndEvent):
+                key = ResourceIO._build_node(
+                    loader, loader.get_event(), anchors
+                )
+                value[key] = ResourceIO._build_node(
+                    loader, loader.get_event(), anchors
+                )
+            loader.get_event()
+        if event.anchor:
+            anchors[event.anchor] = value
+        return value
+
+    @staticmethod
+    def _construct_scalar(loader, event):
+        """
+        Construct python value of the scalar event (resolving its tag)
+
+        The tag constructor is called directly as ``construct_object`` would
+        cache every node in ``loader.constructed_objects`` for the whole
+        document.
+        """
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(tag, event.value, style=event.style)
+        constructors = loader.yaml_constructors
+        return constructors.get(tag, constructors[None])(loader, node)
+
     @staticmethod
     def dump(filename: str, data):
         """
@@ -60,31 +297,191 @@ class ResourceIO:
         """
         if filename.startswith("s3://"):
             return ResourceIO._dump_to_s3(filename, data)
-        with open(filename, "w") as f:
+        with ResourceIO._atomic_open(filename, "w") as f:
             yaml.dump(data, f, default_flow_style=False, sort_keys=False)
+            ResourceIO._count(written=f.tell())
 
     @staticmethod
-    def _load_from_s3(path: str):
+    def version(filename: str):
         """
-        Load YAML data from an S3 object.
+        Get a token identifying the current version of a file or S3 object.
+
+        :param filename: The path to the file or the S3 URI (e.g., 's3://bucket/key')
+        :type filename: str
+        :returns: (inode, mtime, size) of local files, ETag of S3 objects or
+                  None when it does not exist
+        """
+        if filename.startswith("s3://"):
+            bucket_name, key = ResourceIO._parse_s3_path(filename)
+            try:
+                return boto3.client("s3").head_object(
+                    Bucket=bucket_name, Key=key
+                )["ETag"]
+            except ClientError as e:
+                if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                    return None
+                print(f"Error accessing S3: {e}", file=sys.stderr)
+                sys.exit(1)
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def update(filename: str, func):
+        """
+        Safely update a file or an S3 object by a read-modify-write cycle.
+
+        Local files are locked by an advisory lock on ``<filename>.lock``
+        for the whole cycle. S3 objects are written conditionally on the
+        ETag of the loaded version; when another writer wins, the object is
+        reloaded and ``func`` is applied again (up to ``UPDATE_RETRIES``).
+
+        :param filename: The path to the file or the S3 URI (e.g., 's3://bucket/key')
+        :type filename: str
+        :param func: Function receiving the current data (None when the
+                     file does not exist) and returning the data to save
+        :type func: callable
+        """
+        ResourceIO.update_streamed(
+            filename,
+            lambda path: func(ResourceIO.load(path) if path else None),
+        )
+
+    @staticmethod
+    def update_streamed(filename: str, func, version=None):
+        """
+        Like :meth:`update` but ``func`` parses the current content itself.
+
+        ``func`` receives a path to a local file with the current content
+        (eg. to be walked by :meth:`iter_records`) or None when there is
+        nothing to merge, that is when the file does not exist or it still
+        matches the ``version`` (see :meth:`version`) the caller loaded.
+
+        :param filename: The path to the file or the S3 URI (e.g., 's3://bucket/key')
+        :type filename: str
+        :param func: Function receiving the path to the current content (or
+                     None) and returning the data to save
+        :type func: callable
+        :param version: Version of the content known to the caller
+        """
+        if filename.startswith("s3://"):
+            return ResourceIO._update_s3(filename, func, version)
+        with open(f"{filename}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                current = ResourceIO.version(filename)
+                if current is None or (
+                    version is not None and current == version
+                ):
+                    ResourceIO.dump(filename, func(None))
+                else:
+                    ResourceIO.dump(filename, func(filename))
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    @contextmanager
+    def _atomic_open(filename: str, mode: str):
+        """
+        Open a temporary file which replaces ``filename`` on success.
+
+        :param filename: The path to the destination file
+        :type filename: str
+        :param mode: Writing mode ("w" or "wb")
+        :type mode: str
+        :returns: File object
+        """
+        try:
+            perms = os.stat(filename).st_mode & 0o777
+        except FileNotFoundError:
+            perms = 0o644
+        temp_file = tempfile.NamedTemporaryFile(
+            mode=mode,
+            dir=os.path.dirname(os.path.abspath(filename)),
+            prefix=f".{os.path.basename(filename)}.",
+            delete=False,
+        )
+        try:
+            with temp_file:
+                yield temp_file
+            os.chmod(temp_file.name, perms)
+            os.replace(temp_file.name, filename)
+        except BaseException:
+            os.remove(temp_file.name)
+            raise
+
+    @staticmethod
+    @contextmanager
+    def open_writer(filename: str):
+        """
+        Open a file or an S3 object for incremental binary writing.
+
+        S3 objects are staged in a temporary file and uploaded when the
+        context exits without an exception.
+
+        :param filename: The path to the file or the S3 URI (e.g., 's3://bucket/key')
+        :type filename: str
+
+        :returns: Binary file-like object
+        """
+        if not filename.startswith("s3://"):
+            with ResourceIO._atomic_open(filename, "wb") as f:
+                yield f
+                ResourceIO._count(written=f.tell())
+            return
+        bucket_name, key = ResourceIO._parse_s3_path(filename)
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".yaml")
+        try:
+            with temp_file:
+                yield temp_file
+                ResourceIO._count(written=temp_file.tell())
+            s3_client = boto3.client("s3")
+            s3_client.upload_file(temp_file.name, bucket_name, key)
+        finally:
+            os.remove(temp_file.name)
+
+    @staticmethod
+    def _parse_s3_path(path: str):
+        """
+        Split S3 URI into bucket and key.
 
         :param path: The S3 URI (e.g., 's3://bucket/key')
         :type path: str
 
-        :returns: The loaded YAML data
-        :rtype: dict or list or any
+        :returns: tuple(bucket_name, key)
+        :rtype: tuple
 
         :raises ValueError: If the S3 path format is invalid
         """
         if not S3_SUPPORT:
-            print("For s3:// support install boto3 python libraries")
+            print(
+                "For s3:// support install boto3 python libraries",
+                file=sys.stderr,
+            )
             sys.exit(1)
 
         s3_path = path[5:]
         if "/" not in s3_path:
             raise ValueError("Invalid S3 path format")
 
-        bucket_name, key = s3_path.split("/", 1)
+        return s3_path.split("/", 1)
+
+    @staticmethod
+    def _load_from_s3(path: str):
+        """
+        Load YAML data from an S3 object.
+
+        :param path: The S3 URI (e.g., 's3://bucket/key')
+        :type path: str
+
+        :returns: The loaded YAML data
+        :rtype: dict or list or any
+
+        :raises ValueError: If the S3 path format is invalid
+        """
+        bucket_name, key = ResourceIO._parse_s3_path(path)
 
         temp_file = tempfile.NamedTemporaryFile(delete=False)
         temp_file.close()
@@ -92,9 +489,10 @@ class ResourceIO:
             s3_client = boto3.client("s3")
             s3_client.download_file(bucket_name, key, temp_file.name)
             with open(temp_file.name, "r") as f:
+                ResourceIO._count(read=os.fstat(f.fileno()).st_size)
                 return yaml.safe_load(f)
         except ClientError as e:
-            print(f"Error downloading from S3: {e}")
+            print(f"Error downloading from S3: {e}", file=sys.stderr)
             sys.exit(1)
         finally:
             os.remove(temp_file.name)
@@ -110,15 +508,7 @@ class ResourceIO:
         :param data: The data to be saved
         :type data: dict or list or any
         """
-        if not S3_SUPPORT:
-            print("For s3:// support install boto3 python libraries")
-            sys.exit(1)
-
-        s3_path = path[5:]
-        if "/" not in s3_path:
-            raise ValueError("Invalid S3 path format")
-
-        bucket_name, key = s3_path.split("/", 1)
+        bucket_name, key = ResourceIO._parse_s3_path(path)
 
         temp_file = tempfile.NamedTemporaryFile(
             mode="w", delete=False, suffix=".yaml"
@@ -127,8 +517,147 @@ class ResourceIO:
             temp_file.write(
                 yaml.dump(data, default_flow_style=False, sort_keys=False)
             )
+            ResourceIO._count(written=temp_file.tell())
             temp_file.close()
             s3_client = boto3.client("s3")
             s3_client.upload_file(temp_file.name, bucket_name, key)
         finally:
             os.remove(temp_file.name)
+
+    @staticmethod
+    def _update_s3(path: str, func, version=None):
+        """
+        Update S3 object using ETag-conditional writes.
+
+        :param path: The S3 URI (e.g., 's3://bucket/key')
+        :type path: str
+        :param func: Function receiving the path to a local copy of the
+                     current content (or None) and returning the data to save
+        :type func: callable
+        :param version: ETag of the content known to the caller
+        """
+        bucket_name, key = ResourceIO._parse_s3_path(path)
+        s3_client = boto3.client("s3")
+        for attempt in range(ResourceIO.UPDATE_RETRIES + 1):
+            temp_file = tempfile.NamedTemporaryFile(delete=False)
+            try:
+                try:
+                    etag = None
+                    if version is not None:
+                        etag = s3_client.head_object(
+                            Bucket=bucket_name, Key=key
+                        )["ETag"]
+                    if etag is not None and etag == version:
+                        current = None
+                    else:
+                        obj = s3_client.get_object(Bucket=bucket_name, Key=key)
+                        etag = obj["ETag"]
+                        shutil.copyfileobj(obj["Body"], temp_file)
+                        ResourceIO._count(read=temp_file.tell())
+                        current = temp_file.name
+                    condition = {"IfMatch": etag}
+                except ClientError as e:
+                    if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                        print(
+                            f"Error downloading from S3: {e}", file=sys.stderr
+                        )
+                        sys.exit(1)
+                    current = None
+                    condition = {"IfNoneMatch": "*"}
+                temp_file.close()
+                body = yaml.dump(
+                    func(current), default_flow_style=False, sort_keys=False
+                ).encode()
+            finally:
+                temp_file.close()
+                os.remove(temp_file.name)
+            try:
+                s3_client.put_object(
+                    Bucket=bucket_name, Key=key, Body=body, **condition
+                )
+                ResourceIO._count(written=len(body))
+                return
+            except ClientError as e:
+                code = e.response["Error"]["Code"]
+                if code not in (
+                    "PreconditionFailed",
+                    "ConditionalRequestConflict",
+                ):
+                    raise
+                print(
+                    f"Concurrent update of {path} detected, merging and "
+                    "retrying",
+                    file=sys.stderr,
+                )
+                time.sleep(0.1 * 2**attempt)
+        print(
+            f"Unable to update {path}: too many concurrent updates",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+class StateWriter:
+    """
+    Incrementally writes tracked resources into a resources file.
+
+    Resources are serialized one by one as items of a YAML list so the
+    whole inventory never needs to be held in memory. Only the keys are
+    remembered to skip duplicates; as written items can not be revised the
+    first occurrence wins. Note this differs from
+    :meth:`AwsResourceCleaner.run` which keeps the last occurrence (both
+    occurrences share the same ``__seen__``, only the remaining fields such
+    as tags might differ).
+
+    The file is replaced atomically, but unlike :meth:`ResourceIO.update`
+    (used by :meth:`AwsResourceCleaner.run`) it is neither locked nor
+    merged with changes of concurrent writers, which are therefore lost;
+    callers have to serialize their runs themselves.
+
+    Usage::
+
+        resources = ResourceIO.load_state("resources.yaml")
+        with StateWriter("resources.yaml") as writer:
+            for decision in cleaner.iter_decisions(resources, awsweeper):
+                if decision.tracked:
+                    writer.write(decision.resource)
+    """
+
+    def __init__(self, filename: str):
+        """
+        :param filename: The path to the file or the S3 URI (e.g., 's3://bucket/key')
+        :type filename: str
+        """
+        self.filename = filename
+        self.count = 0
+        self._keys = set()
+        self._context = None
+        self._stream = None
+
+    def __enter__(self):
+        self._context = ResourceIO.open_writer(self.filename)
+        self._stream = self._context.__enter__()
+        return self
+
+    def write(self, resource):
+        """
+        Append the resource to the file.
+
+        :param resource: Resource dict (containing "type" and "id")
+        :type resource: dict
+        """
+        key = (resource["type"], resource["id"])
+        if key in self._keys:
+            return
+        self._keys.add(key)
+        self.count += 1
+        self._stream.write(
+            yaml.dump(
+                [resource], default_flow_style=False, sort_keys=False
+            ).encode()
+        )
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None and not self.count:
+            self._stream.write(b"[]\n")
+        return self._context.__exit__(exc_type, exc_value, traceback)
@@ -0,0 +1,171 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright: Red Hat Inc. 2025
+# Author: Lukas Doktor <ldoktor@redhat.com>
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+# Metric name -> help; all metrics describe a single run hence are gauges
+METRICS = {
+    "resources": "Number of resources per type and state "
+    "(tracked/new/expired/deferred/skipped_dependent)",
+    "createdat_parse_failures": "Number of resources with unparsable "
+    "createdat",
+    "rule_matches": "Number of resources matched by each rule",
+    "phase_duration_seconds": "Duration of each phase of the run",
+    "bytes_read": "Number of bytes read from resources/awsweeper files",
+    "bytes_written": "Number of bytes written to resources/cleanup files",
+    "awsweeper_exit_status": "Exit status of awsweeper",
+}
+
+
+class Metrics:
+    """
+    Collects the metrics of a single run and exports them.
+
+    Values are keyed by (name, labels) where labels is a sorted tuple of
+    (label, value) pairs. The object is picklable so it can be collected in
+    worker processes and merged afterwards.
+    """
+
+    PREFIX = "awscleaner_"
+
+    def __init__(self):
+        self.values = defaultdict(float)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increment the metric
+
+        :param name: Metric name (see ``METRICS``)
+        :param value: How much to increment
+        :param labels: Metric labels
+        """
+        self.values[self._key(name, labels)] += value
+
+    def set(self, name, value, **labels):
+        """
+        Set the metric value
+
+        :param name: Metric name (see ``METRICS``)
+        :param value: The new value
+        :param labels: Metric labels
+        """
+        self.values[self._key(name, labels)] = value
+
+    def merge(self, other):
+        """
+        Add values of other Metrics object into this one
+
+        :param other: Metrics to be merged
+        :type other: Metrics
+        """
+        for key, value in other.values.items():
+            self.values[key] += value
+
+    def timed(self, phase, func):
+        """
+        Wrap function to record its duration as ``phase_duration_seconds``
+
+        :param phase: Name of the phase
+        :param func: Function to be wrapped
+        :returns: Wrapped function
+        """
+
+        def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.set(
+                    "phase_duration_seconds",
+                    time.monotonic() - start,
+                    phase=phase,
+                )
+
+        return wrapper
+
+    def to_openmetrics(self):
+        """
+        Format the metrics in OpenMetrics/Prometheus text format
+
+        :returns: The metrics text
+        :rtype: str
+        """
+        by_name = defaultdict(list)
+        for (name, labels), value in sorted(self.values.items()):
+            by_name[name].append((labels, value))
+        lines = []
+        for name, samples in by_name.items():
+            full_name = self.PREFIX + name
+            lines.append(f"# HELP {full_name} {METRICS.get(name, name)}")
+            lines.append(f"# TYPE {full_name} gauge")
+            for labels, value in samples:
+                if labels:
+                    label_str = ",".join(
+                        f'{label}="{self._escape(str(label_value))}"'
+                        for label, label_value in labels
+                    )
+                    lines.append(f"{full_name}{{{label_str}}} {value}")
+                else:
+                    lines.append(f"{full_name} {value}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _escape(value):
+        return (
+            value.replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n")
+        )
+
+    def to_json(self):
+        """
+        Format the metrics as JSON
+
+        :returns: JSON text with list of {name, labels, value} samples
+        :rtype: str
+        """
+        samples = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(self.values.items())
+        ]
+        return json.dumps(samples, indent=2)
+
+    @staticmethod
+    def write(path, text):
+        """
+        Atomically write the text to a local file
+
+        The text is written to a temporary file in the same directory which
+        is then renamed, so collectors never see a partial file.
+
+        :param path: Destination path
+        :param text: Content to be written
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=directory, prefix=".metrics-", delete=False
+        ) as temp_file:
+            temp_file.write(text)
+        os.chmod(temp_file.name, 0o644)
+        os.replace(temp_file.name, path)
@@ -0,0 +1,157 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright: Red Hat Inc. 2025
+# Author: Lukas Doktor <ldoktor@redhat.com>
+import re
+from collections import defaultdict
+
+from .io_utils import ResourceIO
+
+
+class Policy:
+    """
+    Per-type age policy compiled into an index.
+
+    The policy file is a YAML mapping::
+
+        types:                      # default age per resource type
+          aws_instance: 2d
+        rules:
+          - name: ci-runners        # optional, defaults to "rule<N>"
+            age: 6h
+            tag: Name               # exact tag key
+            value: ci-runner        # optional exact value (default: any)
+            types: [aws_instance]   # optional, default: all types
+          - age: 12h
+            regexp: "ci-.*"         # matched against tag keys and values
+            tags: [Name, Owner]     # optional, only values of these keys
+            types: [aws_instance]
+
+    Exact rules are indexed by type and then by tag key so only the rules
+    that can apply are evaluated; regexp rules are only used as a fallback
+    when no exact rule matched. The lowest matching age wins (rules might
+    share a name, eg. to be accounted together in the metrics).
+    """
+
+    def __init__(self, data, age_parser=float):
+        """
+        :param data: Parsed policy (see class docstring)
+        :type data: dict
+        :param age_parser: Function to parse ages into seconds
+        :type age_parser: callable
+        :raises ValueError: When the policy is malformed
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Policy has to be a mapping")
+        self.type_ages = {
+            rtype: age_parser(str(age))
+            for rtype, age in (data.get("types") or {}).items()
+        }
+        # type (None = any) -> tag key -> [(value or None, age, name)]
+        self._exact = defaultdict(lambda: defaultdict(list))
+        # type (None = any) -> [(regexp, tag keys or None, age, name)]
+        self._regexps = defaultdict(list)
+        for i, rule in enumerate(data.get("rules") or []):
+            if not isinstance(rule, dict) or "age" not in rule:
+                raise ValueError(f"Policy rule {i} has no age: {rule}")
+            for key in ("types", "tags"):
+                if not isinstance(rule.get(key, []), list):
+                    raise ValueError(
+                        f"Policy rule {i} '{key}' has to be a list: {rule}"
+                    )
+            name = rule.get("name", f"rule{i}")
+            age = age_parser(str(rule["age"]))
+            types = rule.get("types") or [None]
+            if "tag" in rule:
+                value = rule.get("value")
+                if value is not None:
+                    # Tag values are strings (value: 123 is parsed as int)
+                    value = str(value)
+                for rtype in types:
+                    self._exact[rtype][rule["tag"]].append((value, age, name))
+            elif "regexp" in rule:
+                regexp = re.compile(rule["regexp"])
+                tags = rule.get("tags")
+                for rtype in types:
+                    self._regexps[rtype].append((regexp, tags, age, name))
+            else:
+                raise ValueError(
+                    f"Policy rule {i} needs either 'tag' or 'regexp': {rule}"
+                )
+        # Drop the defaultdict factories to keep the object picklable
+        self._exact = {
+            rtype: dict(rules) for rtype, rules in self._exact.items()
+        }
+        self._regexps = dict(self._regexps)
+
+    @classmethod
+    def load(cls, filename, age_parser=float):
+        """
+        Load the policy from a file or an S3 object.
+
+        :param filename: The path to the file or the S3 URI
+        :type filename: str
+        :param age_parser: Function to parse ages into seconds
+        :type age_parser: callable
+        :rtype: Policy
+        """
+        return cls(ResourceIO.load(filename) or {}, age_parser)
+
+    def match(self, resource, metrics=None):
+        """
+        Get the lowest age of the rules matching the resource.
+
+        :param resource: resource dict
+        :param metrics: Metrics to account the rule matches to
+        :return: Age in seconds or None when no rule matches
+        :rtype: float
+        """
+        rtype = resource.get("type")
+        tags = resource.get("tags") or {}
+        matched = {}
+        for scope in (rtype, None):
+            by_key = self._exact.get(scope)
+            if not by_key:
+                continue
+            for tkey, tvalue in tags.items():
+                for value, age, name in by_key.get(tkey, ()):
+                    if value is None or value == str(tvalue):
+                        matched[name] = min(age, matched.get(name, age))
+        if not matched:
+            rid = resource.get("id")
+            for scope in (rtype, None):
+                for regexp, keys, age, name in self._regexps.get(scope, ()):
+                    if self._match_regexp(regexp, keys, tags, rid):
+                        matched[name] = min(age, matched.get(name, age))
+        if not matched:
+            return None
+        if metrics is not None:
+            for name in matched:
+                metrics.inc("rule_matches", rule=name)
+        return min(matched.values())
+
+    @staticmethod
+    def _match_regexp(regexp, keys, tags, rid):
+        """Match regexp against tag keys/values (and id when not scoped)"""
+        if keys is not None:
+            return any(
+                isinstance(tags.get(key), str) and regexp.match(tags[key])
+                for key in keys
+            )
+        for tkey, tvalue in tags.items():
+            if isinstance(tkey, str) and regexp.match(tkey):
+                return True
+            if isinstance(tvalue, str) and regexp.match(tvalue):
+                return True
+        return isinstance(rid, str) and bool(regexp.match(rid))
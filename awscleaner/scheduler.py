@@ -0,0 +1,196 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright: Red Hat Inc. 2025
+# Author: Lukas Doktor <ldoktor@redhat.com>
+import sys
+from collections import defaultdict
+
+from .io_utils import ResourceIO
+
+
+class ScanScheduler:
+    """
+    Churn-aware scheduling of awsweeper scans per resource type.
+
+    For each resource type the schedule file records when it was scanned
+    last, its churn (exponentially weighted fraction of resources that
+    appeared or disappeared per scan), the current rescan interval and the
+    number of scanned resources not tracked in the resources file (eg.
+    ``createdat`` ones). Stable types get their interval doubled (starting
+    at ``BASE_INTERVAL``) up to ``max_staleness``; any churn above
+    ``churn_threshold`` resets it so the type is scanned on every run again.
+    Volatile types and types with untracked resources (those can not be
+    carried forward from the resources file) are always scanned.
+
+    :ivar BASE_INTERVAL: First rescan interval of a type that became stable
+    :vartype BASE_INTERVAL: float
+    :ivar CHURN_WEIGHT: Weight of the last scan in the churn average
+    :vartype CHURN_WEIGHT: float
+    """
+
+    BASE_INTERVAL = 3600
+    CHURN_WEIGHT = 0.5
+
+    def __init__(
+        self,
+        schedule_file,
+        max_staleness,
+        churn_threshold=0.01,
+        volatile_types=None,
+    ):
+        """
+        :param schedule_file: Path to the schedule file (or S3 URI)
+        :type schedule_file: str
+        :param max_staleness: Maximum time between scans of a type
+        :type max_staleness: float
+        :param churn_threshold: Churn below which a type is considered stable
+        :type churn_threshold: float
+        :param volatile_types: Types to be scanned on every run
+        :type volatile_types: list, optional
+        """
+        self.schedule_file = schedule_file
+        self.max_staleness = max_staleness
+        self.churn_threshold = churn_threshold
+        self.volatile_types = set(volatile_types or [])
+        self.schedule = {}
+
+    def load(self):
+        """Load the schedule (missing file or S3 object means empty one)"""
+        if ResourceIO.version(self.schedule_file) is None:
+            self.schedule = {}
+        else:
+            self.schedule = ResourceIO.load(self.schedule_file) or {}
+
+    def save(self):
+        """
+        Save the schedule
+
+        The schedule is merged with the current content of the file so
+        concurrent runs do not lose updates; the newer ``last_scan`` wins.
+        """
+        ResourceIO.update(self.schedule_file, self._merge)
+
+    def _merge(self, current):
+        """
+        Merge our schedule with the current content of the schedule file
+
+        :param current: Current content of the schedule file
+        :type current: dict or None
+        :returns: Merged schedule
+        :rtype: dict
+        """
+        merged = dict(current or {})
+        for rtype, entry in self.schedule.items():
+            theirs = merged.get(rtype)
+            if not theirs or theirs["last_scan"] <= entry["last_scan"]:
+                merged[rtype] = entry
+        return merged
+
+    def plan(self, types, now):
+        """
+        Decide which resource types can skip the scan in this run.
+
+        :param types: All resource types to be scanned
+        :type types: iterable
+        :param now: Timestamp of the current run
+        :type now: float
+        :returns: Set of types to be carried forward from the state
+        :rtype: set
+        """
+        skipped = set()
+        for rtype in types:
+            entry = self.schedule.get(rtype)
+            if rtype in self.volatile_types or not entry:
+                continue
+            if entry.get("untracked") != 0:
+                # Not (known to be) fully tracked, can not be carried forward
+                continue
+            if now - entry["last_scan"] < min(
+                entry["interval"], self.max_staleness
+            ):
+                skipped.add(rtype)
+        if skipped:
+            print(
+                f"Carrying forward stable types: {', '.join(sorted(skipped))}",
+                file=sys.stderr,
+            )
+        return skipped
+
+    def update(
+        self, types, resources_dict, scanned_resources, updated_resources, now
+    ):
+        """
+        Record churn of the scanned types and adjust their intervals.
+
+        Every scanned resource counts into the churn; the untracked ones
+        (eg. ``createdat``) have no state, therefore only the change of
+        their number since the last scan is accounted as churn.
+
+        :param types: Resource types scanned in this run
+        :type types: iterable
+        :param resources_dict: Dictionary of the loaded resources
+        :type resources_dict: dict
+        :param scanned_resources: List of resources from the scan
+        :type scanned_resources: list
+        :param updated_resources: List of updated resource dictionaries
+        :type updated_resources: list
+        :param now: Timestamp of the current run
+        :type now: float
+        """
+        types = set(types)
+        tracked = {(r["type"], r["id"]) for r in updated_resources}
+        totals = defaultdict(int)
+        changes = defaultdict(int)
+        untracked = defaultdict(int)
+        current = set()
+        for r in scanned_resources:
+            key = (r["type"], r["id"])
+            if key[0] not in types:
+                continue
+            totals[key[0]] += 1
+            if key not in tracked:
+                untracked[key[0]] += 1
+            elif key not in current:
+                current.add(key)
+                if key not in resources_dict:
+                    changes[key[0]] += 1
+        for key in resources_dict:
+            if key[0] in types and key not in current:
+                totals[key[0]] += 1
+                changes[key[0]] += 1
+        for rtype in types:
+            entry = self.schedule.get(rtype)
+            changes[rtype] += abs(
+                untracked[rtype] - (entry or {}).get("untracked", 0)
+            )
+            churn = min(changes[rtype] / max(totals[rtype], 1), 1)
+            interval = 0
+            if entry:
+                churn = (
+                    self.CHURN_WEIGHT * churn
+                    + (1 - self.CHURN_WEIGHT) * entry["churn"]
+                )
+                interval = entry["interval"]
+            if churn > self.churn_threshold:
+                interval = 0
+            else:
+                interval = min(
+                    max(interval * 2, self.BASE_INTERVAL), self.max_staleness
+                )
+            self.schedule[rtype] = {
+                "last_scan": now,
+                "churn": churn,
+                "interval": interval,
+                "untracked": untracked[rtype],
+            }
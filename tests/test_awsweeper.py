@@ -1,8 +1,10 @@
+import os
 import subprocess
 
 import pytest
+import yaml
 
-from awscleaner.awsweeper import AwsweeperRunner
+from awscleaner.awsweeper import AwsweeperError, AwsweeperRunner
 
 
 def test_run_returns_list(monkeypatch):
@@ -19,3 +21,170 @@ def test_run_returns_list(monkeypatch):
     output = AwsweeperRunner.run(["dummy.yaml"])
     assert isinstance(output, list)
     assert output[0]["type"] == "ec2"
+
+
+@pytest.mark.parametrize("returncode,stdout", [(3, ""), (0, "- [unbalanced")])
+def test_run_error_returncode(monkeypatch, returncode, stdout):
+    def fake_run(*args, **kwargs):
+        class Result:
+            pass
+
+        Result.returncode = returncode
+        Result.stdout = stdout
+        Result.stderr = "error"
+        return Result()
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    with pytest.raises(AwsweeperError) as exc:
+        AwsweeperRunner.run_checkpointed([])
+    assert exc.value.returncode == returncode
+
+
+def fake_awsweeper(calls, failing=()):
+    """Fake subprocess.run of awsweeper failing in the specified regions"""
+
+    def fake_run(cmd, **kwargs):
+        region = cmd[cmd.index("--region") + 1]
+        calls.append(region)
+
+        class Result:
+            returncode = 1 if region in failing else 0
+            stdout = f"- type: ec2\n  id: i-{region}"
+            stderr = "throttled"
+
+        return Result()
+
+    return fake_run
+
+
+def test_run_checkpointed_resumes(monkeypatch, tmp_path):
+    calls = []
+    failing = {"us-east-1"}
+    monkeypatch.setattr(subprocess, "run", fake_awsweeper(calls, failing))
+    monkeypatch.setattr("awscleaner.awsweeper.time.sleep", lambda _: None)
+    checkpoint_dir = tmp_path / "checkpoints"
+    regions = ["eu-west-1", "us-east-1"]
+
+    with pytest.raises(AwsweeperError):
+        AwsweeperRunner.run_checkpointed(
+            [], str(checkpoint_dir), regions=regions, retries=2
+        )
+    assert calls == ["eu-west-1"] + ["us-east-1"] * 3
+    assert [p.name[:14] for p in checkpoint_dir.iterdir()] == [
+        "eu-west-1-all-"
+    ]
+
+    calls.clear()
+    failing.clear()
+    output = AwsweeperRunner.run_checkpointed(
+        [], str(checkpoint_dir), regions=regions
+    )
+    assert calls == ["us-east-1"]
+    assert [r["id"] for r in output] == ["i-eu-west-1", "i-us-east-1"]
+    assert not list(checkpoint_dir.iterdir())
+
+
+def test_run_checkpointed_discards_stale(monkeypatch, tmp_path):
+    calls = []
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    regions = ["eu-west-1", "us-east-1"]
+
+    def interrupted_scan(args):
+        """Leave the eu-west-1 checkpoint behind"""
+        monkeypatch.setattr(
+            subprocess, "run", fake_awsweeper(calls, {"us-east-1"})
+        )
+        with pytest.raises(AwsweeperError):
+            AwsweeperRunner.run_checkpointed(args, checkpoint_dir, regions)
+        monkeypatch.setattr(subprocess, "run", fake_awsweeper(calls))
+        calls.clear()
+
+    # Changed arguments do not reuse the checkpoint
+    interrupted_scan(["--profile", "a"])
+    AwsweeperRunner.run_checkpointed(
+        ["--profile", "b"], checkpoint_dir, regions
+    )
+    assert calls == regions
+
+    # Too old checkpoints are not reused
+    interrupted_scan([])
+    for name in os.listdir(checkpoint_dir):
+        os.utime(os.path.join(checkpoint_dir, name), (0, 0))
+    AwsweeperRunner.run_checkpointed(
+        [], checkpoint_dir, regions, checkpoint_max_age=60
+    )
+    assert calls == regions
+
+    # Checkpoints not covered by the current run are removed
+    interrupted_scan([])
+    AwsweeperRunner.run_checkpointed([], checkpoint_dir, ["us-east-1"])
+    assert calls == ["us-east-1"]
+    assert os.listdir(checkpoint_dir) == []
+
+
+def test_run_checkpointed_config(monkeypatch, tmp_path):
+    configs = []
+
+    def fake_run(cmd, **kwargs):
+        with open(cmd[-1]) as f:
+            configs.append(yaml.safe_load(f))
+
+        class Result:
+            returncode = 0
+            stdout = "[]"
+            stderr = ""
+
+        return Result()
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    config = tmp_path / "awsweeper.yaml"
+    config.write_text("aws_vpc:\naws_instance:\n  - tags: {a: b}\naws_eip:\n")
+    types = {"aws_instance", "aws_eip"}
+
+    # Without checkpoints all types are scanned at once
+    AwsweeperRunner.run_checkpointed([], config=str(config), types=types)
+    assert configs == [
+        {"aws_instance": [{"tags": {"a": "b"}}], "aws_eip": None}
+    ]
+
+    configs.clear()
+    AwsweeperRunner.run_checkpointed(
+        [], str(tmp_path / "checkpoints"), config=str(config), types=types
+    )
+    assert configs == [
+        {"aws_instance": [{"tags": {"a": "b"}}]},
+        {"aws_eip": None},
+    ]
+
+    configs.clear()
+    assert (
+        AwsweeperRunner.run_checkpointed([], config=str(config), types=set())
+        == []
+    )
+    assert configs == []
+
+
+def test_run_checkpointed_global_resources(monkeypatch):
+    def fake_run(cmd, **kwargs):
+        region = cmd[cmd.index("--region") + 1]
+
+        class Result:
+            returncode = 0
+            stdout = (
+                "- {type: aws_iam_role, id: role}\n"
+                f"- {{type: aws_instance, id: i-{region}}}\n"
+            )
+            stderr = ""
+
+        return Result()
+
+    monkeypatch.setattr(subprocess, "run", fake_run)
+    output = AwsweeperRunner.run_checkpointed(
+        [], regions=["eu-west-1", "us-east-1", "us-west-2"]
+    )
+    assert [r["id"] for r in output] == [
+        "role",
+        "i-eu-west-1",
+        "i-us-east-1",
+        "i-us-west-2",
+    ]
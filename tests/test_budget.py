@@ -0,0 +1,92 @@
+import random
+
+from awscleaner.budget import DeletionBudget
+
+
+def offer_all(budget, items):
+    for seen, rtype, rid in items:
+        budget.offer(seen, {"type": rtype, "id": rid})
+    return [r["id"] for r in budget.selected()]
+
+
+ITEMS = [
+    (5, "ec2", "a"),
+    (1, "s3", "b"),
+    (3, "ec2", "c"),
+    (2, "ec2", "d"),
+    (4, "s3", "e"),
+    (0, "vpc", "f"),
+]
+
+
+def test_unlimited_keeps_order():
+    budget = DeletionBudget()
+    assert offer_all(budget, ITEMS) == ["a", "b", "c", "d", "e", "f"]
+    assert not budget.deferred
+
+
+def test_global_limit():
+    budget = DeletionBudget(max_deletions=3)
+    assert offer_all(budget, ITEMS) == ["b", "d", "f"]
+    assert dict(budget.deferred) == {"ec2": 2, "s3": 1}
+
+
+def test_per_type_limit():
+    budget = DeletionBudget(max_per_type={"ec2": 1, "vpc": 0})
+    assert offer_all(budget, ITEMS) == ["b", "d", "e"]
+    assert dict(budget.deferred) == {"ec2": 2, "vpc": 1}
+
+
+def test_combined_limits():
+    budget = DeletionBudget(max_deletions=2, max_per_type={"s3": 1})
+    assert offer_all(budget, ITEMS) == ["b", "f"]
+    assert dict(budget.deferred) == {"ec2": 3, "s3": 1}
+
+
+def reference(items, max_deletions, max_per_type):
+    """Select by sorting everything (oldest first, then offer order)"""
+    by_age = sorted(enumerate(items), key=lambda item: (item[1][0], item[0]))
+    per_type = {}
+    eligible = []
+    for seq, (seen, rtype, rid) in by_age:
+        per_type[rtype] = per_type.get(rtype, 0) + 1
+        if per_type[rtype] <= max_per_type.get(rtype, len(items)):
+            eligible.append((seq, rid))
+    if max_deletions is not None:
+        eligible = eligible[:max_deletions]
+    return [rid for _, rid in sorted(eligible)]
+
+
+def test_matches_reference():
+    rand = random.Random(42)
+    for _ in range(200):
+        items = [
+            (rand.randint(0, 20), f"t{rand.randint(0, 4)}", str(i))
+            for i in range(rand.randint(0, 60))
+        ]
+        max_deletions = rand.choice([None, 0, 1, 5, 20])
+        max_per_type = {
+            f"t{i}": rand.randint(0, 6) for i in range(rand.randint(0, 5))
+        }
+        budget = DeletionBudget(max_deletions, max_per_type)
+        selected = offer_all(budget, items)
+        assert selected == reference(items, max_deletions, max_per_type)
+        assert sum(budget.deferred.values()) == len(items) - len(selected)
+
+
+def test_memory_bound():
+    budget = DeletionBudget(
+        max_deletions=10, max_per_type={f"t{i}": 10 for i in range(100)}
+    )
+    for i in range(10000):
+        budget.offer(-i, {"type": f"t{i % 100}", "id": str(i)})
+    stored = {
+        id(entry)
+        for heap in [budget._global] + list(budget._heaps.values())
+        for entry in heap.entries
+    }
+    # Both live and (lazily dropped) dead entries are bounded by the limit
+    assert len(stored) <= 4 * 10
+    assert [r["id"] for r in budget.selected()] == [
+        str(i) for i in range(9990, 10000)
+    ]
@@ -1,9 +1,19 @@
+import contextlib
 import datetime
+import io
+import json
+import pickle
 import re
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 import pytest
+import yaml
 
-from awscleaner.cleaner import AwsResourceCleaner
+from awscleaner.awsweeper import AwsweeperError
+from awscleaner.cleaner import AwsResourceCleaner, Decision
+from awscleaner.io_utils import ResourceIO
 
 
 def sort_key(r):
@@ -279,6 +289,315 @@ def test_tag_regexp(monkeypatch):
     )
 
 
+def test_process_resources_parallel(monkeypatch):
+    def resources():
+        ret = [
+            {
+                "type": f"type{i % 3}",
+                "id": f"id{i}",
+                "tags": {"Name": f"ci-{i}" if i % 5 else f"keep-{i}"},
+            }
+            for i in range(50)
+        ]
+        ret.append({"type": "type1", "id": "id7", "dup": True})
+        ret.append({"type": "type2", "id": "c", "createdat": "1970-01-01"})
+        ret.append({"type": "aws_iam_user_policy", "id": "dependent"})
+        return ret
+
+    monkeypatch.setattr("awscleaner.cleaner.time.time", lambda: 172803)
+    resources_dict = {(f"type{i % 3}", f"id{i}"): i for i in range(0, 50, 2)}
+    tag_regexps = [(-1, re.compile(r"ci-.*")), (10, re.compile(r"keep-.*"))]
+
+    serial = AwsResourceCleaner("resources.yaml", tag_regexps=tag_regexps)
+    expected = serial._process_resources(resources_dict, resources())
+
+    parallel = AwsResourceCleaner(
+        "resources.yaml", tag_regexps=tag_regexps, jobs=3
+    )
+    parallel.CHUNK_SIZE = 7
+    assert parallel._process_resources(resources_dict, resources()) == (
+        expected
+    )
+
+
+def test_process_resources_parallel_settings(monkeypatch):
+    monkeypatch.setattr("awscleaner.cleaner.time.time", lambda: 1000)
+    cleaner = AwsResourceCleaner("resources.yaml", jobs=2)
+    cleaner.CHUNK_SIZE = 1
+    cleaner.THRESHOLD = 100
+    # Only the decision loop settings are shipped to the workers (pickled
+    # unless the pool forks)
+    cleaner._carried = [lambda: "not picklable"]
+    pool = ProcessPoolExecutor
+
+    def pickling_pool(*args, **kwargs):
+        pickle.dumps(kwargs["initargs"])
+        return pool(*args, **kwargs)
+
+    monkeypatch.setattr(
+        "awscleaner.cleaner.ProcessPoolExecutor", pickling_pool
+    )
+    updated, deletion = cleaner._process_resources(
+        {("ec2", "old"): 800, ("ec2", "young"): 950},
+        [{"type": "ec2", "id": "old"}, {"type": "ec2", "id": "young"}],
+    )
+    assert [r["id"] for r in deletion] == ["old"]
+    assert len(updated) == 2
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_process_resources_duplicates(monkeypatch, jobs):
+    """run() keeps the last occurrence (unlike StateWriter)"""
+    monkeypatch.setattr("awscleaner.cleaner.time.time", lambda: 1000)
+    cleaner = AwsResourceCleaner("resources.yaml", jobs=jobs)
+    cleaner.CHUNK_SIZE = 1
+    updated, _ = cleaner._process_resources(
+        {("ec2", "1"): 500},
+        [
+            {"type": "ec2", "id": "1", "tags": {"a": "first"}},
+            {"type": "ec2", "id": "2"},
+            {"type": "ec2", "id": "1", "tags": {"a": "last"}},
+        ],
+    )
+    assert updated == [
+        {"type": "ec2", "id": "1", "tags": {"a": "last"}, "__seen__": 500},
+        {"type": "ec2", "id": "2", "__seen__": 1000},
+    ]
+
+
+def test_run_concurrent_failure(monkeypatch, tmp_path):
+    resources_file = tmp_path / "resources.yaml"
+    resources_file.write_text("- {type: ec2, id: '1', __seen__: 1}\n")
+    cleaner = AwsResourceCleaner(str(resources_file))
+
+    def failing_awsweeper(args, **kwargs):
+        raise AwsweeperError("boom", 2)
+
+    monkeypatch.setattr(
+        "awscleaner.cleaner.AwsweeperRunner.run_checkpointed",
+        failing_awsweeper,
+    )
+    with pytest.raises(SystemExit):
+        cleaner.run()
+    # Nothing should be written on failure
+    assert "__seen__: 1" in resources_file.read_text()
+    assert cleaner.metrics.values[("awsweeper_exit_status", ())] == 2
+
+
+def test_run_load_failure_fail_fast(monkeypatch, tmp_path):
+    cleaner = AwsResourceCleaner(str(tmp_path / "resources.yaml"))
+    scan_started = threading.Event()
+    scan_release = threading.Event()
+    scan_finished = threading.Event()
+
+    def failing_load():
+        scan_started.wait(5)
+        sys.exit(1)
+
+    def blocking_awsweeper(args, **kwargs):
+        scan_started.set()
+        scan_release.wait(5)
+        scan_finished.set()
+        return []
+
+    monkeypatch.setattr(cleaner, "_load_resources", failing_load)
+    monkeypatch.setattr(
+        "awscleaner.cleaner.AwsweeperRunner.run_checkpointed",
+        blocking_awsweeper,
+    )
+    try:
+        with pytest.raises(SystemExit):
+            cleaner.run()
+        # The load failure is reported while the scan is still running
+        assert not scan_finished.is_set()
+    finally:
+        scan_release.set()
+
+
+def test_save_cleanup_sinks(capsys, tmp_path):
+    cleaner = AwsResourceCleaner(
+        "resources.yaml",
+        cleanup_file=str(tmp_path / "cleanup.yaml"),
+        cleanup_sinks=[str(tmp_path / "extra.yaml")],
+        cleanup_per_type=str(tmp_path / "cleanup-{type}.yaml"),
+    )
+    cleaner.CLEANUP_BATCH = 2
+    deletion = [
+        {"type": "type2", "id": "id1"},
+        {"type": "type1", "id": "id2"},
+        {"type": "type2", "id": "123"},
+        {"type": "type2", "id": "id:4"},
+    ]
+
+    cleaner._save_cleanup(deletion)
+
+    expected = {
+        "type1": [{"id": "id2"}],
+        "type2": [{"id": "id1"}, {"id": "123"}, {"id": "id:4"}],
+    }
+    stdout = capsys.readouterr().out
+    assert stdout == yaml.dump(expected)
+    assert (tmp_path / "cleanup.yaml").read_text() == stdout
+    assert (tmp_path / "extra.yaml").read_text() == stdout
+    for rtype, ids in expected.items():
+        path = tmp_path / f"cleanup-{rtype}.yaml"
+        assert yaml.safe_load(path.read_text()) == {rtype: ids}
+
+
+def test_iter_decisions():
+    cleaner = AwsResourceCleaner("resources.yaml")
+    awsweeper_resources = [
+        {"type": "ec2", "id": "keep"},
+        {"type": "ec2", "id": "new"},
+        {"type": "ec2", "id": "old"},
+        {"type": "s3", "id": "created", "createdat": "1970-01-01T00:00:00Z"},
+        {"type": "s3", "id": "fresh", "createdat": "1970-01-03T00:00:00Z"},
+        {"type": "aws_iam_user_policy", "id": "dependent"},
+    ]
+    resources_dict = {("ec2", "keep"): 172000, ("ec2", "old"): 1}
+
+    decisions = list(
+        cleaner.iter_decisions(
+            resources_dict, iter(awsweeper_resources), now=172803
+        )
+    )
+
+    assert [(d.resource["id"], d.kind, d.tracked) for d in decisions] == [
+        ("keep", Decision.KEEP, True),
+        ("new", Decision.NEW, True),
+        ("old", Decision.EXPIRED_SEEN, True),
+        ("created", Decision.EXPIRED_CREATEDAT, False),
+        ("fresh", Decision.KEEP, False),
+        ("dependent", Decision.SKIPPED_DEPENDENT, False),
+    ]
+    assert decisions[1].resource["__seen__"] == 172803
+    assert [d.expired for d in decisions] == [0, 0, 1, 1, 0, 0]
+
+
+def test_process_resources_max_deletions(monkeypatch):
+    monkeypatch.setattr("awscleaner.cleaner.time.time", lambda: 172803)
+    cleaner = AwsResourceCleaner("resources.yaml", max_deletions=2)
+    resources_dict = {("ec2", str(i)): 4 - i for i in range(5)}
+    awsweeper_resources = [{"type": "ec2", "id": str(i)} for i in range(5)]
+
+    updated, deletion = cleaner._process_resources(
+        resources_dict, awsweeper_resources
+    )
+
+    assert [r["id"] for r in deletion] == ["3", "4"]
+    # Deferred resources are still tracked
+    assert len(updated) == 5
+
+
+def test_save_resources_merges_concurrent_updates(tmp_path):
+    resources_file = tmp_path / "resources.yaml"
+    resources_file.write_text(
+        "- {type: ec2, id: gone, __seen__: 1}\n"
+        "- {type: ec2, id: kept, __seen__: 5}\n"
+        "- {type: ec2, id: other, __seen__: 3}\n"
+    )
+    cleaner = AwsResourceCleaner(str(resources_file))
+    # "other" was added by a concurrent run after we loaded the file
+    loaded = {("ec2", "gone"): 1, ("ec2", "kept"): 7}
+    updated = [
+        {"type": "ec2", "id": "kept", "__seen__": 7},
+        {"type": "ec2", "id": "new", "__seen__": 9},
+    ]
+
+    cleaner._save_resources(updated, loaded)
+
+    assert yaml.safe_load(resources_file.read_text()) == [
+        {"type": "ec2", "id": "kept", "__seen__": 5},
+        {"type": "ec2", "id": "new", "__seen__": 9},
+        {"type": "ec2", "id": "other", "__seen__": 3},
+    ]
+
+
+def test_save_resources_skips_unchanged(monkeypatch, tmp_path):
+    resources_file = tmp_path / "resources.yaml"
+    resources_file.write_text("- {type: ec2, id: gone, __seen__: 1}\n")
+    cleaner = AwsResourceCleaner(str(resources_file))
+    loaded = cleaner._load_resources()
+    walked = []
+    iter_records = ResourceIO.iter_records
+    monkeypatch.setattr(
+        ResourceIO,
+        "iter_records",
+        lambda path, *args: walked.append(path) or iter_records(path, *args),
+    )
+    updated = [{"type": "ec2", "id": "new", "__seen__": 9}]
+
+    cleaner._save_resources(updated, loaded)
+    assert walked == []
+    assert yaml.safe_load(resources_file.read_text()) == updated
+
+    # Changed by someone else since loaded, merge it
+    resources_file.write_text("- {type: ec2, id: other, __seen__: 3}\n")
+    cleaner._save_resources(updated, loaded)
+    assert walked == [str(resources_file)] * 2
+    assert yaml.safe_load(resources_file.read_text()) == updated + [
+        {"type": "ec2", "id": "other", "__seen__": 3}
+    ]
+
+
+def test_change_feed(monkeypatch, tmp_path):
+    now = [100]
+    monkeypatch.setattr("awscleaner.cleaner.time.time", lambda: now[0])
+    resources_file = tmp_path / "resources.yaml"
+    resources_file.write_text("- {type: ec2, id: gone, __seen__: 1}\n")
+    awsweeper_file = tmp_path / "awsweeper.yaml"
+    awsweeper_file.write_text("- {type: ec2, id: a}\n- {type: ec2, id: b}\n")
+    feed = tmp_path / "changes.jsonl"
+    cleaner = AwsResourceCleaner(
+        str(resources_file),
+        awsweeper_file=str(awsweeper_file),
+        change_feed=str(feed),
+    )
+    cleaner.THRESHOLD = 10
+
+    def events():
+        cleaner.run()
+        return [
+            (c["event"], c["id"])
+            for c in map(json.loads, feed.read_text().splitlines())
+        ]
+
+    assert events() == [
+        ("appeared", "a"),
+        ("appeared", "b"),
+        ("disappeared", "gone"),
+    ]
+    now[0] = 200
+    assert events() == [("deletable", "a"), ("deletable", "b")]
+    awsweeper_file.write_text("- {type: ec2, id: b}\n")
+    assert events() == [("disappeared", "a")]
+
+
+def test_run_single_timestamp(monkeypatch, tmp_path):
+    ticks = iter(range(1000, 2000))
+    monkeypatch.setattr("awscleaner.cleaner.time.time", lambda: next(ticks))
+    resources_file = tmp_path / "resources.yaml"
+    resources_file.write_text("[]\n")
+    awsweeper_file = tmp_path / "awsweeper.yaml"
+    awsweeper_file.write_text("- {type: ec2, id: a}\n- {type: ec2, id: b}\n")
+    cleaner = AwsResourceCleaner(
+        str(resources_file), awsweeper_file=str(awsweeper_file)
+    )
+
+    cleaner.run()
+
+    seen = [r["__seen__"] for r in yaml.safe_load(resources_file.read_text())]
+    assert seen == [1000, 1000]
+
+
+def test_save_cleanup_text_stdout():
+    cleaner = AwsResourceCleaner("resources.yaml")
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        cleaner._save_cleanup([{"type": "type1", "id": "id1"}])
+    assert yaml.safe_load(stdout.getvalue()) == {"type1": [{"id": "id1"}]}
+
+
 """
 def test_save_cleanup(monkeypatch):
     cleaner = AwsResourceCleaner(
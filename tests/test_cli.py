@@ -0,0 +1,27 @@
+import pytest
+
+from awscleaner.cli import parse_age
+
+
+@pytest.mark.parametrize(
+    "value,seconds",
+    [
+        ("10", 10.0),
+        ("1.5", 1.5),
+        ("5s", 5.0),
+        ("2m", 120.0),
+        ("1h", 3600.0),
+        ("1d", 86400.0),
+        ("1D", 86400.0),
+        ("1M", 2592000.0),
+        ("1y", 31536000.0),
+        ("1Y", 31536000.0),
+    ],
+)
+def test_parse_age(value, seconds):
+    assert parse_age(value) == seconds
+
+
+def test_parse_age_invalid():
+    with pytest.raises(ValueError):
+        parse_age("1w")
@@ -1,9 +1,13 @@
+import datetime
+import io
 import os
 import tempfile
+import threading
 
+import pytest
 import yaml
 
-from awscleaner.io_utils import ResourceIO
+from awscleaner.io_utils import ResourceIO, StateWriter
 
 
 def test_local_file_load_and_dump():
@@ -16,3 +20,217 @@ def test_local_file_load_and_dump():
 
     assert loaded == data
     os.remove(tmp.name)
+
+
+def test_state_writer(tmp_path):
+    path = str(tmp_path / "resources.yaml")
+    with StateWriter(path) as writer:
+        writer.write({"type": "ec2", "id": "1", "tags": {"a": "b"}})
+        writer.write({"type": "ec2", "id": "2"})
+        # The first occurrence wins (unlike run())
+        writer.write({"type": "ec2", "id": "1", "duplicate": True})
+    assert ResourceIO.load(path) == [
+        {"type": "ec2", "id": "1", "tags": {"a": "b"}},
+        {"type": "ec2", "id": "2"},
+    ]
+
+    with StateWriter(path):
+        pass
+    assert ResourceIO.load(path) == []
+
+
+def test_load_state(tmp_path):
+    path = str(tmp_path / "resources.yaml")
+    with StateWriter(path) as writer:
+        writer.write({"type": "ec2", "id": "1", "__seen__": 5, "tags": {}})
+        writer.write({"type": "ec2", "id": "2"})
+    assert ResourceIO.load_state(path) == {("ec2", "1"): 5, ("ec2", "2"): 0}
+
+
+def test_update_concurrent(tmp_path):
+    path = str(tmp_path / "counter.yaml")
+
+    def increment():
+        for _ in range(20):
+            ResourceIO.update(path, lambda current: (current or 0) + 1)
+
+    threads = [threading.Thread(target=increment) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ResourceIO.load(path) == 100
+    assert [p.name for p in tmp_path.iterdir() if p.name[0] == "."] == []
+
+
+def test_update_s3_conflict(monkeypatch):
+    botocore = pytest.importorskip("botocore.exceptions")
+
+    class FakeS3:
+        def __init__(self):
+            self.data = b"- 1\n"
+            self.etag = "v1"
+            self.puts = 0
+
+        def get_object(self, Bucket, Key):
+            return {"Body": io.BytesIO(self.data), "ETag": self.etag}
+
+        def put_object(self, Bucket, Key, Body, IfMatch):
+            self.puts += 1
+            if self.puts == 1:
+                # Simulate concurrent writer winning the race
+                self.data, self.etag = b"- 1\n- 2\n", "v2"
+            if IfMatch != self.etag:
+                raise botocore.ClientError(
+                    {"Error": {"Code": "PreconditionFailed"}}, "PutObject"
+                )
+            self.data = Body
+
+    fake = FakeS3()
+    monkeypatch.setattr("awscleaner.io_utils.boto3.client", lambda _: fake)
+    monkeypatch.setattr("awscleaner.io_utils.time.sleep", lambda _: None)
+    ResourceIO.update("s3://bucket/key", lambda current: current + [3])
+    assert yaml.safe_load(fake.data) == [1, 2, 3]
+
+
+def test_update_s3_gives_up_on_stderr(monkeypatch, capsys):
+    botocore = pytest.importorskip("botocore.exceptions")
+
+    class FakeS3:
+        def get_object(self, Bucket, Key):
+            return {"Body": io.BytesIO(b"[]"), "ETag": "v1"}
+
+        def put_object(self, **kwargs):
+            raise botocore.ClientError(
+                {"Error": {"Code": "PreconditionFailed"}}, "PutObject"
+            )
+
+    monkeypatch.setattr("awscleaner.io_utils.boto3.client", lambda _: FakeS3())
+    monkeypatch.setattr("awscleaner.io_utils.time.sleep", lambda _: None)
+    monkeypatch.setattr(ResourceIO, "UPDATE_RETRIES", 1)
+    with pytest.raises(SystemExit):
+        ResourceIO.update("s3://bucket/key", lambda current: current)
+    # stdout carries the cleanup list
+    out, err = capsys.readouterr()
+    assert out == ""
+    assert "too many concurrent updates" in err
+
+
+def test_update_streamed_s3_unchanged(monkeypatch):
+    pytest.importorskip("botocore.exceptions")
+
+    class FakeS3:
+        def __init__(self):
+            self.data = b"- 1\n"
+            self.gets = 0
+
+        def head_object(self, Bucket, Key):
+            return {"ETag": "v1"}
+
+        def get_object(self, Bucket, Key):
+            self.gets += 1
+            return {"Body": io.BytesIO(self.data), "ETag": "v1"}
+
+        def put_object(self, Bucket, Key, Body, IfMatch):
+            assert IfMatch == "v1"
+            self.data = Body
+
+    fake = FakeS3()
+    monkeypatch.setattr("awscleaner.io_utils.boto3.client", lambda _: fake)
+    assert ResourceIO.version("s3://bucket/key") == "v1"
+    ResourceIO.update_streamed("s3://bucket/key", lambda path: [path], "v1")
+    assert fake.gets == 0
+    assert yaml.safe_load(fake.data) == [None]
+
+    def merge(path):
+        with open(path) as f:
+            return yaml.safe_load(f) + [2]
+
+    ResourceIO.update_streamed("s3://bucket/key", merge, "v0")
+    assert fake.gets == 1
+    assert yaml.safe_load(fake.data) == [None, 2]
+
+
+@pytest.mark.parametrize("loader", ["SafeLoader", "CSafeLoader"])
+def test_iter_records(monkeypatch, tmp_path, loader):
+    if not hasattr(yaml, loader):
+        pytest.skip(f"yaml.{loader} not available")
+    monkeypatch.setattr(
+        "awscleaner.io_utils.yaml.CSafeLoader",
+        getattr(yaml, loader),
+        raising=False,
+    )
+    data = [
+        {
+            "type": "ec2",
+            "tags": {"id": "nested", "type": [1, {"a": None}]},
+            "id": "i-1",
+            "__seen__": 1712345678.123,
+        },
+        {"type": "s3", "id": 123, "extra": [[{"__seen__": 1}]]},
+        {"type": "s3", "id": "123", "__seen__": 5, "__expired__": True},
+        {"id": "2025-01-01", "type": "s3", "createdat": "2025-01-01"},
+    ]
+    path = tmp_path / "resources.yaml"
+    ResourceIO.dump(str(path), data)
+    fields = {"type", "id", "__seen__", "__expired__"}
+
+    records = list(ResourceIO.iter_records(str(path), fields))
+
+    assert records == [
+        {key: value for key, value in r.items() if key in fields}
+        for r in yaml.safe_load(path.read_text())
+    ]
+    assert records[0] == {
+        "type": "ec2",
+        "id": "i-1",
+        "__seen__": 1712345678.123,
+    }
+
+    path.write_text("")
+    assert list(ResourceIO.iter_records(str(path), fields)) == []
+    path.write_text("[]")
+    assert list(ResourceIO.iter_records(str(path), fields)) == []
+
+
+def test_iter_records_full_types(tmp_path):
+    data = [
+        {"tags": {"a": [1]}, "type": "ec2", "id": "1", "__seen__": 1},
+        {"tags": {"a": [2]}, "type": "s3", "id": "2", "extra": None},
+        {"type": "s3", "id": "3", "tags": {"b": "c"}},
+    ]
+    path = tmp_path / "resources.yaml"
+    ResourceIO.dump(str(path), data)
+
+    records = ResourceIO.iter_records(str(path), {"type", "id"}, {"s3"})
+
+    assert list(records) == [{"type": "ec2", "id": "1"}] + data[1:]
+
+
+def test_iter_records_no_node_cache(monkeypatch, tmp_path):
+    def construct_object(*args, **kwargs):
+        raise AssertionError("caches the node for the whole document")
+
+    monkeypatch.setattr(
+        yaml.constructor.BaseConstructor, "construct_object", construct_object
+    )
+    path = tmp_path / "resources.yaml"
+    path.write_text(
+        "- {type: ec2, id: 1, __seen__: 1.5, flag: true}\n"
+        "- {type: s3, id: b, createdat: 2025-01-01, tags: {a: null}}\n"
+    )
+
+    records = ResourceIO.iter_records(str(path), {"type", "id"}, {"s3"})
+
+    assert list(records) == [
+        {"type": "ec2", "id": 1},
+        {
+            "type": "s3",
+            "id": "b",
+            "createdat": datetime.date(2025, 1, 1),
+            "tags": {"a": None},
+        },
+    ]
+    with pytest.raises(yaml.constructor.ConstructorError):
+        path.write_text("- {type: !unknown ec2}\n")
+        list(ResourceIO.iter_records(str(path), {"type"}))
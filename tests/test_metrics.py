@@ -0,0 +1,56 @@
+import json
+
+from awscleaner.cleaner import AwsResourceCleaner
+from awscleaner.metrics import Metrics
+
+
+def test_openmetrics_format():
+    metrics = Metrics()
+    metrics.inc("resources", type="ec2", state="new")
+    metrics.inc("resources", type="ec2", state="new")
+    metrics.set("awsweeper_exit_status", 0)
+    text = metrics.to_openmetrics()
+    assert "# TYPE awscleaner_resources gauge" in text
+    assert 'awscleaner_resources{state="new",type="ec2"} 2' in text
+    assert "awscleaner_awsweeper_exit_status 0" in text
+    assert text.endswith("# EOF\n")
+
+
+def test_run_writes_metrics(monkeypatch, tmp_path):
+    monkeypatch.setattr("awscleaner.cleaner.time.time", lambda: 172803)
+    resources_file = tmp_path / "resources.yaml"
+    resources_file.write_text("- {type: ec2, id: old, __seen__: 1}\n")
+    awsweeper_file = tmp_path / "awsweeper.yaml"
+    awsweeper_file.write_text(
+        "- {type: ec2, id: old}\n"
+        "- {type: ec2, id: new}\n"
+        "- {type: aws_iam_user_policy, id: dep}\n"
+        "- {type: s3, id: bad, createdat: not-a-date}\n"
+    )
+    cleaner = AwsResourceCleaner(
+        str(resources_file),
+        awsweeper_file=str(awsweeper_file),
+        metrics_file=str(tmp_path / "awscleaner.prom"),
+        metrics_json_file=str(tmp_path / "awscleaner.json"),
+    )
+
+    cleaner.run()
+
+    samples = {
+        (s["name"], tuple(sorted(s["labels"].items()))): s["value"]
+        for s in json.loads((tmp_path / "awscleaner.json").read_text())
+    }
+    assert samples[("resources", (("state", "tracked"), ("type", "ec2")))] == 2
+    assert samples[("resources", (("state", "new"), ("type", "ec2")))] == 1
+    assert samples[("resources", (("state", "expired"), ("type", "ec2")))] == 1
+    key = (
+        "resources",
+        (("state", "skipped_dependent"), ("type", "aws_iam_user_policy")),
+    )
+    assert samples[key] == 1
+    assert samples[("createdat_parse_failures", ())] == 1
+    assert samples[("bytes_read", ())] > 0
+    assert samples[("bytes_written", ())] > 0
+    assert ("phase_duration_seconds", (("phase", "process"),)) in samples
+    prom = (tmp_path / "awscleaner.prom").read_text()
+    assert "awscleaner_bytes_written" in prom
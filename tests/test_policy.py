@@ -0,0 +1,103 @@
+import pickle
+
+import pytest
+
+from awscleaner.cleaner import AwsResourceCleaner
+from awscleaner.cli import parse_age
+from awscleaner.policy import Policy
+
+POLICY = {
+    "types": {"aws_instance": "1d", "aws_iam_role": "1y"},
+    "rules": [
+        {"name": "ci", "age": "6h", "tag": "Name", "value": "ci-runner"},
+        {"age": "1h", "tag": "Temporary", "types": ["aws_instance"]},
+        {
+            "name": "owner",
+            "age": "12h",
+            "regexp": "ci-.*",
+            "tags": ["Owner"],
+            "types": ["aws_instance"],
+        },
+        {"name": "any", "age": "2h", "regexp": ".*-tmp"},
+    ],
+}
+
+
+def test_policy_match():
+    policy = Policy(POLICY, parse_age)
+    instance = {"type": "aws_instance", "id": "i-1"}
+    assert policy.match(instance) is None
+    assert policy.type_ages["aws_instance"] == 86400
+
+    instance["tags"] = {"Name": "ci-runner", "Owner": "ci-bot"}
+    # Exact rules win over regexps
+    assert policy.match(instance) == 6 * 3600
+    instance["tags"] = {"Name": "foo", "Owner": "ci-bot"}
+    assert policy.match(instance) == 12 * 3600
+    instance["tags"] = {"Temporary": "", "Owner": "ci-bot"}
+    assert policy.match(instance) == 3600
+    # Type scoped rules do not apply to other types
+    bucket = {"type": "aws_s3_bucket", "id": "b", "tags": {"Temporary": ""}}
+    assert policy.match(bucket) is None
+    bucket["id"] = "bucket-tmp"
+    assert policy.match(bucket) == 2 * 3600
+    pickle.dumps(policy)
+
+
+def test_policy_shared_name():
+    policy = Policy(
+        {
+            "rules": [
+                {"name": "tmp", "age": 3600, "tag": "Temporary"},
+                {"name": "tmp", "age": 5 * 3600, "tag": "Name"},
+                {"name": "re", "age": 60, "regexp": "tmp-.*"},
+                {"name": "re", "age": 30, "regexp": "tmp-.*"},
+            ]
+        }
+    )
+    resource = {"type": "t", "id": "i", "tags": {"Temporary": 1, "Name": 2}}
+    assert policy.match(resource) == 3600
+    assert policy.match({"type": "t", "id": "tmp-1"}) == 30
+
+
+def test_policy_invalid():
+    with pytest.raises(ValueError):
+        Policy({"rules": [{"tag": "Name"}]})
+    with pytest.raises(ValueError):
+        Policy({"rules": [{"age": 1}]})
+    # Scalars would be iterated by characters
+    with pytest.raises(ValueError):
+        Policy({"rules": [{"age": 1, "tag": "a", "types": "aws_vpc"}]})
+    with pytest.raises(ValueError):
+        Policy({"rules": [{"age": 1, "regexp": "a", "tags": "Name"}]})
+
+
+def test_policy_numeric_value():
+    policy = Policy({"rules": [{"age": 60, "tag": "Build", "value": 123}]})
+    resource = {"type": "t", "id": "i", "tags": {"Build": "123"}}
+    assert policy.match(resource) == 60
+    resource["tags"]["Build"] = "12"
+    assert policy.match(resource) is None
+
+
+def test_policy_deadline(monkeypatch):
+    monkeypatch.setattr("awscleaner.cleaner.time.time", lambda: 200000)
+    cleaner = AwsResourceCleaner(
+        "resources.yaml", policy=Policy(POLICY, parse_age)
+    )
+    resources_dict = {
+        ("aws_instance", "default"): 200000 - 86401,
+        ("aws_instance", "fresh"): 200000 - 86399,
+        ("aws_instance", "ci"): 200000 - 6 * 3600 - 1,
+        ("aws_vpc", "global"): 200000 - 86401,
+    }
+    awsweeper_resources = [
+        {"type": "aws_instance", "id": "default"},
+        {"type": "aws_instance", "id": "fresh"},
+        {"type": "aws_instance", "id": "ci", "tags": {"Name": "ci-runner"}},
+        {"type": "aws_vpc", "id": "global"},
+    ]
+    _, deletion = cleaner._process_resources(
+        resources_dict, awsweeper_resources
+    )
+    assert [r["id"] for r in deletion] == ["default", "ci"]
@@ -0,0 +1,181 @@
+import io
+
+import pytest
+import yaml
+
+from awscleaner.cleaner import AwsResourceCleaner
+from awscleaner.scheduler import ScanScheduler
+
+
+def test_plan_and_update(tmp_path):
+    scheduler = ScanScheduler(
+        str(tmp_path / "schedule.yaml"),
+        max_staleness=10000,
+        volatile_types=["aws_instance"],
+    )
+    scheduler.load()
+    types = {"aws_instance", "aws_iam_role", "aws_vpc"}
+    assert scheduler.plan(types, 0) == set()
+
+    loaded = {("aws_iam_role", "r1"): 0, ("aws_vpc", "v1"): 0}
+    updated = [
+        {"type": "aws_iam_role", "id": "r1"},
+        {"type": "aws_vpc", "id": "v2"},
+        {"type": "aws_instance", "id": "i1"},
+    ]
+    scheduler.update(types, loaded, updated, updated, 100)
+    assert scheduler.schedule["aws_iam_role"]["interval"] == 3600
+    assert scheduler.schedule["aws_vpc"]["churn"] == 1
+    assert scheduler.schedule["aws_vpc"]["interval"] == 0
+
+    assert scheduler.plan(types, 200) == {"aws_iam_role"}
+    assert scheduler.plan(types, 3700) == set()
+    # Stable types double the interval up to max_staleness
+    for i in range(5):
+        scheduler.update({"aws_iam_role"}, loaded, updated, updated, 100)
+    assert scheduler.schedule["aws_iam_role"]["interval"] == 10000
+
+    scheduler.save()
+    scheduler.load()
+    assert scheduler.schedule["aws_iam_role"]["interval"] == 10000
+
+
+def test_run_carries_forward(monkeypatch, tmp_path):
+    monkeypatch.setattr("awscleaner.cleaner.time.time", lambda: 1000)
+    config = tmp_path / "awsweeper.yaml"
+    config.write_text("aws_instance:\naws_iam_role:\n")
+    resources_file = tmp_path / "resources.yaml"
+    resources_file.write_text(
+        "- {type: aws_iam_role, id: r1, __seen__: 900, tags: {Name: x}}\n"
+        "- {type: aws_instance, id: i1, __seen__: 900}\n"
+    )
+    schedule_file = tmp_path / "schedule.yaml"
+    schedule_file.write_text(
+        yaml.dump(
+            {
+                "aws_iam_role": {
+                    "last_scan": 999,
+                    "churn": 0,
+                    "interval": 10,
+                    "untracked": 0,
+                },
+                "aws_instance": {
+                    "last_scan": 999,
+                    "churn": 1,
+                    "interval": 0,
+                    "untracked": 0,
+                },
+            }
+        )
+    )
+    scanned = []
+
+    def fake_scan(args, **kwargs):
+        scanned.append(kwargs["types"])
+        return [{"type": "aws_instance", "id": "i2"}]
+
+    monkeypatch.setattr(
+        "awscleaner.cleaner.AwsweeperRunner.run_checkpointed", fake_scan
+    )
+    cleaner = AwsResourceCleaner(
+        str(resources_file),
+        awsweeper_config=str(config),
+        scheduler=ScanScheduler(str(schedule_file), 100),
+    )
+
+    cleaner.run()
+
+    assert scanned == [{"aws_instance"}]
+    assert yaml.safe_load(resources_file.read_text()) == [
+        {"type": "aws_instance", "id": "i2", "__seen__": 1000},
+        {
+            "type": "aws_iam_role",
+            "id": "r1",
+            "__seen__": 900,
+            "tags": {"Name": "x"},
+        },
+    ]
+    schedule = yaml.safe_load(schedule_file.read_text())
+    assert schedule["aws_iam_role"]["last_scan"] == 999
+    assert schedule["aws_instance"]["last_scan"] == 1000
+
+
+def test_createdat_only_type(tmp_path):
+    scheduler = ScanScheduler(str(tmp_path / "schedule.yaml"), 10000)
+    scheduler.load()
+    types = {"aws_s3_bucket"}
+    scanned = [
+        {"type": "aws_s3_bucket", "id": "b1", "createdat": "1970-01-01"},
+        {"type": "aws_s3_bucket", "id": "b2", "createdat": "1970-01-01"},
+    ]
+    scheduler.update(types, {}, scanned, [], 100)
+    entry = scheduler.schedule["aws_s3_bucket"]
+    assert entry["churn"] == 1
+    assert entry["untracked"] == 2
+    # Same number of buckets, the churn decays
+    for i in range(10):
+        scheduler.update(types, {}, scanned, [], 100)
+    entry = scheduler.schedule["aws_s3_bucket"]
+    assert entry["churn"] < scheduler.churn_threshold
+    assert entry["interval"] == 10000
+    # ... but it can not be carried forward from the resources file
+    assert scheduler.plan(types, 200) == set()
+    # Neither can be entries of unknown origin
+    del entry["untracked"]
+    assert scheduler.plan(types, 200) == set()
+
+
+def test_save_merges(tmp_path):
+    schedule_file = tmp_path / "schedule.yaml"
+    schedule_file.write_text(
+        yaml.dump(
+            {
+                "aws_vpc": {"last_scan": 500, "churn": 0, "interval": 0},
+                "aws_iam_role": {"last_scan": 50, "churn": 0, "interval": 0},
+                "aws_subnet": {"last_scan": 5, "churn": 0, "interval": 0},
+            }
+        )
+    )
+    scheduler = ScanScheduler(str(schedule_file), 10000)
+    scheduler.schedule = {
+        "aws_vpc": {"last_scan": 100, "churn": 1, "interval": 0},
+        "aws_iam_role": {"last_scan": 100, "churn": 1, "interval": 0},
+    }
+    scheduler.save()
+    schedule = yaml.safe_load(schedule_file.read_text())
+    assert schedule["aws_vpc"]["last_scan"] == 500
+    assert schedule["aws_iam_role"]["last_scan"] == 100
+    assert schedule["aws_subnet"]["last_scan"] == 5
+
+
+def test_load_missing_s3(monkeypatch):
+    botocore = pytest.importorskip("botocore.exceptions")
+
+    class FakeS3:
+        data = None
+
+        def head_object(self, Bucket, Key):
+            if self.data is None:
+                raise botocore.ClientError(
+                    {"Error": {"Code": "404"}}, "HeadObject"
+                )
+            return {"ETag": "v1"}
+
+        def get_object(self, Bucket, Key):
+            if self.data is None:
+                raise botocore.ClientError(
+                    {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+                )
+            return {"Body": io.BytesIO(self.data), "ETag": "v1"}
+
+        def put_object(self, Bucket, Key, Body, **condition):
+            self.data = Body
+
+    fake = FakeS3()
+    monkeypatch.setattr("awscleaner.io_utils.boto3.client", lambda _: fake)
+    scheduler = ScanScheduler("s3://bucket/schedule.yaml", 100)
+    scheduler.load()
+    assert scheduler.schedule == {}
+    scheduler.update({"aws_vpc"}, {}, [], [], 10)
+    scheduler.save()
+    assert yaml.safe_load(fake.data)["aws_vpc"]["last_scan"] == 10